@@ -1,19 +1,34 @@
 import os
 import logging
 import requests
+import urllib3
 import re
 import hashlib
 import json
+import codecs
+import bisect
+import functools
+import gzip
+import heapq
+import math
+import itertools
+import queue
+import random
+import sqlite3
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
 import time
 
 load_dotenv()
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -24,13 +39,120 @@ app = Flask(__name__)
 # Configuration
 #============================================
 
-PANEL_URL = "http://198.135.52.238"
-PANEL_USERNAME = "selva"
-PANEL_PASSWORD = "selva123456"
+PANEL_URL = os.environ.get('PANEL_URL', "http://198.135.52.238")
+PANEL_USERNAME = os.environ.get('PANEL_USERNAME', "selva")
+PANEL_PASSWORD = os.environ.get('PANEL_PASSWORD', "selva123456")
+
+# Several panel accounts can be polled at once: PANELS_FILE (or the PANELS env
+# var) holds a JSON list of {"name", "url", "username", "password", "interval"}.
+# Without it the single panel above is used.
+PANELS_FILE = os.environ.get('PANELS_FILE', 'panels.json')
+POLL_INTERVAL = int(os.environ.get('POLL_INTERVAL', 10))
+POLL_WORKERS = int(os.environ.get('POLL_WORKERS', 8))
+
+# Adaptive polling: a panel that just produced new messages is polled every
+# POLL_MIN_INTERVAL seconds; idle or failing polls back off exponentially (with
+# +-POLL_JITTER) up to POLL_MAX_INTERVAL. POLL_ADAPTIVE=0 keeps fixed intervals.
+POLL_ADAPTIVE = os.environ.get('POLL_ADAPTIVE', '1') == '1'
+POLL_MIN_INTERVAL = float(os.environ.get('POLL_MIN_INTERVAL', 2))
+POLL_MAX_INTERVAL = float(os.environ.get('POLL_MAX_INTERVAL', 60))
+POLL_IDLE_BACKOFF = float(os.environ.get('POLL_IDLE_BACKOFF', 1.5))
+POLL_ERROR_BACKOFF = float(os.environ.get('POLL_ERROR_BACKOFF', 2))
+POLL_JITTER = float(os.environ.get('POLL_JITTER', 0.1))
+
+# Panel HTTP timeouts (seconds) and circuit breaker: after BREAKER_FAILURES
+# consecutive timeouts/connection errors/5xx a panel is skipped for
+# BREAKER_RESET seconds, then a single probe request decides whether to resume.
+PANEL_CONNECT_TIMEOUT = float(os.environ.get('PANEL_CONNECT_TIMEOUT', 5))
+PANEL_READ_TIMEOUT = float(os.environ.get('PANEL_READ_TIMEOUT', 15))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 3))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 30))
+
+# Panel HTTP transport: connection pool per panel, retries with exponential
+# backoff + jitter for GETs (never for the login POST), the longest Retry-After
+# a panel can make a retry wait, and how many per-request timing samples to keep
+# for bot_stats.
+PANEL_POOL_SIZE = int(os.environ.get('PANEL_POOL_SIZE', 10))
+PANEL_RETRIES = int(os.environ.get('PANEL_RETRIES', 2))
+PANEL_RETRY_BACKOFF = float(os.environ.get('PANEL_RETRY_BACKOFF', 0.5))
+PANEL_RETRY_JITTER = float(os.environ.get('PANEL_RETRY_JITTER', 0.3))
+PANEL_RETRY_AFTER_MAX = int(os.environ.get('PANEL_RETRY_AFTER_MAX', 10))
+PANEL_TIMINGS_KEPT = int(os.environ.get('PANEL_TIMINGS_KEPT', 50))
+
+# Pages of at least STREAM_PARSE_MIN_LIMIT messages are parsed incrementally
+# from the socket instead of being read and decoded in one piece.
+STREAM_PARSE_MIN_LIMIT = int(os.environ.get('STREAM_PARSE_MIN_LIMIT', 1000))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 65536))
+
+# Manual refreshes run in the background; this many finished jobs are kept
+REFRESH_JOBS_KEPT = int(os.environ.get('REFRESH_JOBS_KEPT', 100))
 
-all_messages = []
 MAX_MESSAGES = 100
-debug_logs = []
+
+# Debug ring: DEBUG_LOG_LEVEL gates what is kept for the dashboard (stdout follows
+# LOG_LEVEL). Raw panel payloads are only captured on one poll out of
+# DEBUG_PAYLOAD_EVERY, and never with DEBUG_CAPTURE_PAYLOADS=0.
+DEBUG_LOG_SIZE = int(os.environ.get('DEBUG_LOG_SIZE', 50))
+DEBUG_LOG_LEVEL = logging.getLevelName(os.environ.get('DEBUG_LOG_LEVEL', 'DEBUG').upper())
+DEBUG_CAPTURE_PAYLOADS = os.environ.get('DEBUG_CAPTURE_PAYLOADS', '1') == '1'
+DEBUG_PAYLOAD_EVERY = max(1, int(os.environ.get('DEBUG_PAYLOAD_EVERY', 10)))
+
+# Server-Sent Events: events queued per viewer before a slow one is dropped, and
+# how often an idle stream gets a keep-alive comment.
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT', 15))
+
+# Webhooks: WEBHOOKS_FILE (or the WEBHOOKS env var) holds a JSON list of
+# {"url", "service", "country", "phone", "headers"}; service/country match
+# exactly, phone as a prefix, and any left out match everything. New messages are
+# queued (up to WEBHOOK_QUEUE_SIZE, beyond that they are dropped and counted) and
+# POSTed by WEBHOOK_WORKERS threads, up to WEBHOOK_BATCH_MAX per request after
+# waiting WEBHOOK_BATCH_WAIT seconds for a burst to fill. Failed deliveries are
+# retried WEBHOOK_RETRIES times with exponential backoff from WEBHOOK_BACKOFF.
+WEBHOOKS_FILE = os.environ.get('WEBHOOKS_FILE', 'webhooks.json')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_BATCH_MAX = int(os.environ.get('WEBHOOK_BATCH_MAX', 50))
+WEBHOOK_BATCH_WAIT = float(os.environ.get('WEBHOOK_BATCH_WAIT', 0.2))
+WEBHOOK_RETRIES = int(os.environ.get('WEBHOOK_RETRIES', 3))
+WEBHOOK_BACKOFF = float(os.environ.get('WEBHOOK_BACKOFF', 1.0))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 5))
+
+# Read endpoints serve bytes rendered once per store version; bodies bigger than
+# SNAPSHOT_GZIP_MIN are also kept gzipped for clients that accept it.
+SNAPSHOT_GZIP = os.environ.get('SNAPSHOT_GZIP', '1') == '1'
+SNAPSHOT_GZIP_MIN = int(os.environ.get('SNAPSHOT_GZIP_MIN', 1024))
+
+# Multi-worker mode (gunicorn): with SHARED_STATE_DIR set, workers elect a single
+# poller through a file lock there. The poller publishes its state to a file that
+# the other workers pick up every SHARED_SYNC_INTERVAL seconds.
+SHARED_STATE_DIR = os.environ.get('SHARED_STATE_DIR', '')
+SHARED_SYNC_INTERVAL = float(os.environ.get('SHARED_SYNC_INTERVAL', 1))
+
+# Persistent history: path of a SQLite database that keeps every message ever
+# seen (empty = memory only). Served page by page from /api/history.
+HISTORY_DB = os.environ.get('HISTORY_DB', '')
+HISTORY_PAGE_MAX = int(os.environ.get('HISTORY_PAGE_MAX', 500))
+
+# Longest /api/otp/<phone>?wait= a client may ask for. Each waiting request holds
+# a server thread (see GUNICORN_THREADS) but no CPU.
+OTP_WAIT_MAX = float(os.environ.get('OTP_WAIT_MAX', 60))
+
+# Incremental polling: the panel returns newest messages first, so each poll only
+# needs the rows above the last id we saw. PANEL_SINCE_PARAM is the query parameter
+# the panel accepts for "newer than" (leave empty if it has none - we then stop
+# parsing the page at the first already-seen id instead).
+FETCH_LIMIT = int(os.environ.get('FETCH_LIMIT', 100))
+INCREMENTAL_FETCH = os.environ.get('INCREMENTAL_FETCH', '1') == '1'
+PANEL_SINCE_PARAM = os.environ.get('PANEL_SINCE_PARAM', '')
+PANEL_CURSOR_FIELD = os.environ.get('PANEL_CURSOR_FIELD', 'id')
+
+# Dedup cache limits: ids are forgotten after DEDUP_TTL seconds or once more than
+# DEDUP_MAX_SIZE are held (0 disables either limit). With DEDUP_BLOOM_CAPACITY set,
+# forgotten ids move to a fixed-size Bloom filter instead of being dropped.
+DEDUP_MAX_SIZE = int(os.environ.get('DEDUP_MAX_SIZE', 10000))
+DEDUP_TTL = int(os.environ.get('DEDUP_TTL', 86400))
+DEDUP_BLOOM_CAPACITY = int(os.environ.get('DEDUP_BLOOM_CAPACITY', 0))
 
 bot_stats = {
     'start_time': datetime.now(),
@@ -39,10 +161,11 @@ bot_stats = {
     'is_running': False,
     'scraper_status': 'Not initialized',
     'last_error': None,
-    'api_response': None
+    'api_response': None,
+    'panels': {}
 }
 
-scraper = None
+scrapers = None
 
 #============================================
 # أعلام الدول
@@ -88,17 +211,320 @@ COUNTRY_FLAGS = {
     'australia': '🇦🇺', 'au': '🇦🇺',
 }
 
+SERVICE_NAMES = {
+    'whatsapp': 'WhatsApp', 'telegram': 'Telegram',
+    'facebook': 'Facebook', 'instagram': 'Instagram',
+    'twitter': 'Twitter', 'google': 'Google',
+    'tiktok': 'TikTok', 'snapchat': 'Snapchat',
+}
+
+# Extra services/countries can be added without touching the code:
+# {"services": {"viber": "Viber"}, "countries": {"chile": "🇨🇱", "cl": "🇨🇱"}}
+LOOKUP_TABLES_FILE = os.environ.get('LOOKUP_TABLES_FILE', 'lookup_tables.json')
+
 #============================================
 # Debug Log
 #============================================
 
-def add_debug(message):
-    timestamp = datetime.now().strftime('%H:%M:%S')
-    log = f"[{timestamp}] {message}"
-    debug_logs.insert(0, log)
-    if len(debug_logs) > 50:
-        debug_logs.pop()
-    logger.info(message)
+class DebugRecord:
+    # Formatted (with its %-style args) only when somebody reads the log
+    __slots__ = ('created', 'level', 'message', 'args', '_text')
+    
+    def __init__(self, level, message, args, text=None):
+        self.created = time.time()
+        self.level = level
+        self.message = message
+        self.args = args
+        self._text = text
+    
+    @property
+    def text(self):
+        # Readers race here (the log is read without a lock), so args are left in
+        # place and the text is published in one assignment
+        text = self._text
+        if text is None:
+            args = self.args
+            message = self.message % args if args else self.message
+            timestamp = time.strftime('%H:%M:%S', time.localtime(self.created))
+            text = self._text = f"[{timestamp}] {message}"
+        return text
+
+
+class Truncated:
+    # Defers str()/json.dumps of a payload until the log line is rendered
+    __slots__ = ('value', 'limit', 'as_json')
+    
+    def __init__(self, value, limit, as_json=False):
+        self.value = value
+        self.limit = limit
+        self.as_json = as_json
+    
+    def __str__(self):
+        text = json.dumps(self.value, ensure_ascii=False) if self.as_json else str(self.value)
+        return text[:self.limit]
+
+
+debug_events = deque(maxlen=DEBUG_LOG_SIZE)
+
+
+def add_debug(message, *args, level=logging.INFO):
+    if level >= DEBUG_LOG_LEVEL:
+        debug_events.appendleft(DebugRecord(level, message, args))
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args)
+
+
+def debug_log_lines(limit=None):
+    records = debug_events.copy()
+    if limit is not None:
+        records = itertools.islice(records, limit)
+    return [record.text for record in records]
+
+#============================================
+# Metrics
+#============================================
+
+def _label_text(names, values, extra=''):
+    pairs = [
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class CounterMetric:
+    kind = 'counter'
+    
+    def __init__(self, name, help, labels=(), shared=False):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.shared = shared
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in sorted(values):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+    
+    def export(self):
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+    
+    def load(self, data):
+        with self.lock:
+            self.values = {tuple(labels): value for labels, value in data}
+
+
+class HistogramMetric:
+    # Per-bucket (non-cumulative) counts; they are only summed up when rendered
+    kind = 'histogram'
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, name, help, labels=(), buckets=BUCKETS, shared=False):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.shared = shared
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds, *labels):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += seconds
+    
+    def time(self, *labels):
+        return _MetricTimer(self, labels)
+    
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(row)) for labels, row in self.values.items()]
+        for labels, row in sorted(values):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                total += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_label_text(self.labels, labels, le)} {total}"
+            label_text = _label_text(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {row[-1]}"
+            yield f"{self.name}_count{label_text} {total}"
+    
+    def export(self):
+        with self.lock:
+            return [[list(labels), list(row)] for labels, row in self.values.items()]
+    
+    def load(self, data):
+        with self.lock:
+            self.values = {tuple(labels): row for labels, row in data}
+
+
+class _MetricTimer:
+    __slots__ = ('histogram', 'labels', 'start')
+    
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class GaugeMetric:
+    # Read from `read` at scrape time, so nothing is updated on the hot path
+    kind = 'gauge'
+    shared = False
+    
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+    
+    def samples(self):
+        yield f"{self.name} {self.read()}"
+
+
+class MetricsRegistry:
+    # Metrics marked shared are the poller's: in multi-worker mode they travel
+    # with the published state, so any worker can be scraped for them.
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help, labels=(), shared=False):
+        return self.register(CounterMetric(name, help, labels, shared=shared))
+    
+    def histogram(self, name, help, labels=(), shared=False):
+        return self.register(HistogramMetric(name, help, labels, shared=shared))
+    
+    def gauge(self, name, help, read):
+        return self.register(GaugeMetric(name, help, read))
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                add_debug("❌ Metric %s error: %s", metric.name, str(e), level=logging.ERROR)
+        return '\n'.join(lines) + '\n'
+    
+    def export(self):
+        return {m.name: m.export() for m in self.metrics if m.shared}
+    
+    def load(self, data):
+        for metric in self.metrics:
+            if metric.shared and metric.name in data:
+                metric.load(data[metric.name])
+
+
+metrics = MetricsRegistry()
+LOGIN_SECONDS = metrics.histogram('otp_panel_login_seconds', 'Panel login round trips.', ('panel',), shared=True)
+FETCH_SECONDS = metrics.histogram('otp_panel_fetch_seconds', 'Panel /api/sms requests, up to the response headers (the full body unless streamed).', ('panel',), shared=True)
+PARSE_SECONDS = metrics.histogram('otp_panel_parse_seconds', 'Decoding a panel response down to its new rows.', ('panel',), shared=True)
+NORMALIZE_SECONDS = metrics.histogram('otp_normalize_seconds', 'Formatting one page of new rows into messages.', ('panel',), shared=True)
+RENDER_SECONDS = metrics.histogram('otp_render_seconds', 'Building a read snapshot (page or JSON body).', ('snapshot',))
+HTTP_SECONDS = metrics.histogram('otp_http_request_seconds', 'Flask request handling, until the response is returned.', ('route', 'method'))
+POLLS = metrics.counter('otp_polls_total', 'Panel polls by outcome.', ('panel', 'outcome'), shared=True)
+MESSAGES = metrics.counter('otp_messages_total', 'Fetched messages, new or already seen.', ('result',), shared=True)
+ERRORS = metrics.counter('otp_errors_total', 'Handled errors by where they happened and exception type.', ('where', 'type'), shared=True)
+RELOGINS = metrics.counter('otp_relogins_total', 'Logins forced by an expired token (401).', ('panel',), shared=True)
+WEBHOOK_DELIVERIES = metrics.counter('otp_webhook_messages_total', 'Messages delivered to webhooks, or given up on.', ('result',), shared=True)
+WEBHOOK_DROPS = metrics.counter('otp_webhook_dropped_total', 'Messages dropped before delivery.', ('reason',), shared=True)
+WEBHOOK_RETRIES_TOTAL = metrics.counter('otp_webhook_retries_total', 'Webhook requests sent again after a failure.', shared=True)
+WEBHOOK_LATENCY = metrics.histogram('otp_webhook_latency_seconds', 'From a message being accepted to its webhook delivery.', shared=True)
+metrics.gauge('otp_webhook_queue', 'Messages waiting for a webhook worker.', lambda: webhooks.queue.qsize())
+metrics.gauge('otp_store_messages', 'Messages held in the live store.', lambda: len(message_store))
+metrics.gauge('otp_dedup_cache_size', 'Ids held in the dedup cache (excluding the Bloom filter).', lambda: len(otp_filter.cache))
+metrics.gauge('otp_waiters', 'Requests blocked in /api/otp/<phone>?wait= in this worker.', lambda: len(otp_waiters))
+metrics.gauge('otp_stream_subscribers', 'Open /api/stream connections in this worker.', lambda: len(live_events.subscribers))
+
+#============================================
+# فهرس الخدمات والدول (Lookup Index)
+#============================================
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+class KeywordIndex:
+    # Maps whole words (or multi-word phrases) to values. Lookup tokenises the text
+    # once and probes a dict per token, so it is O(text length) and never matches
+    # inside another word ('in' does not hit "Argentina"). Ties go to the key that
+    # comes first in the table, like the old linear scans.
+    def __init__(self, table):
+        self.phrases = {}
+        self.max_words = 1
+        for priority, (key, value) in enumerate(table.items()):
+            words = tuple(_TOKEN_RE.findall(key.lower()))
+            if words and words not in self.phrases:
+                self.phrases[words] = (priority, value)
+                self.max_words = max(self.max_words, len(words))
+    
+    def find(self, text):
+        tokens = _TOKEN_RE.findall(text.lower())
+        best = None
+        for i in range(len(tokens)):
+            for n in range(1, self.max_words + 1):
+                hit = self.phrases.get(tuple(tokens[i:i + n]))
+                if hit and (best is None or hit[0] < best[0]):
+                    best = hit
+        return best[1] if best else None
+
+
+def load_lookup_tables(path):
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, encoding='utf-8') as f:
+            tables = json.load(f)
+        SERVICE_NAMES.update({k.lower(): v for k, v in tables.get('services', {}).items()})
+        COUNTRY_FLAGS.update({k.lower(): v for k, v in tables.get('countries', {}).items()})
+        logger.info(f"Loaded lookup tables from {path}")
+    except Exception as e:
+        logger.warning(f"Could not load lookup tables from {path}: {e}")
+
+
+load_lookup_tables(LOOKUP_TABLES_FILE)
+service_index = KeywordIndex(SERVICE_NAMES)
+country_index = KeywordIndex(COUNTRY_FLAGS)
+
+
+def detect_service(content):
+    if not content:
+        return 'Unknown'
+    return service_index.find(content) or 'SMS Service'
+
+
+@functools.lru_cache(maxsize=1024)
+def country_flag(country):
+    if not country:
+        return '🌍'
+    country_lower = country.lower().strip()
+    if country_lower in COUNTRY_FLAGS:
+        return COUNTRY_FLAGS[country_lower]
+    return country_index.find(country_lower) or '🌍'
 
 #============================================
 # إخفاء جزء من الرقم
@@ -114,307 +540,2006 @@ def mask_phone_number(phone):
         return f"{phone[:5]}•••{phone[-4:]}"
     return f"{phone[:4]}•••{phone[-4:]}"
 
+
+_NON_DIGITS = re.compile(r'\D')
+
+def phone_key(phone):
+    # "+20 10 1234-5678" and "201012345678" are the same number
+    if not phone:
+        return phone
+    return _NON_DIGITS.sub('', str(phone)) or phone
+
+#============================================
+# استخراج الكود (OTP Extraction)
+#============================================
+
+# Keywords that usually sit right next to the real code. Candidates are ranked by
+# how close they are to one of these, so a phone number or a date elsewhere in the
+# text no longer wins just because it comes first.
+OTP_KEYWORDS = ('code', 'kode', 'codigo', 'código', 'otp', 'pin', 'رمز', 'كود')
+
+# One pattern finds keywords and code-shaped numbers in a single scan. The leading
+# lookahead lets the regex engine skip every position that cannot start either.
+# A number is not taken out of a longer grouped one ("+1 555 123 4567"), but a
+# short count after it ("123456 2 minutes") does not disqualify it.
+_OTP_SCAN_RE = re.compile(
+    r'(?=[\d' + ''.join(sorted({kw[0] for kw in OTP_KEYWORDS})) + r'])(?:'
+    r'(?P<kw>\b(?:' + '|'.join(OTP_KEYWORDS) + r'))'
+    r'|(?<![\d+])(?<!\d[-\s])(?:'
+    r'(?P<d44>\d{4}[-\s]\d{4})(?!\d)(?![-\s]\d{3})'
+    r'|(?P<d33>\d{3}[-\s]\d{3})(?!\d)(?![-\s]\d{3})'
+    r'|(?P<dn>\d{4,8})(?!\d)(?![-\s]\d{3})'
+    r'))',
+    re.I
+)
+
+# Without a keyword, keep the old preference: 6 digits, then 4-4, then anything else
+_OTP_SHAPE_RANK = {'d33': 0, 'd44': 1}
+
+
+def _rank_otp_candidate(match, keywords):
+    shape = _OTP_SHAPE_RANK.get(match.lastgroup, 0 if len(match.group()) == 6 else 2)
+    distance = 0
+    if keywords:
+        start, end = match.span()
+        distance = min(
+            start - kw_end if start >= kw_end else (kw_start - end) * 2
+            for kw_start, kw_end in keywords
+        )
+    return (distance, shape, match.start())
+
+
+def extract_otp(content):
+    if not content:
+        return 'N/A'
+    
+    keywords = []
+    candidates = []
+    for match in _OTP_SCAN_RE.finditer(content):
+        if match.lastgroup == 'kw':
+            keywords.append(match.span())
+        else:
+            candidates.append(match)
+    
+    if not candidates:
+        return 'N/A'
+    if len(candidates) == 1:
+        best = candidates[0]
+    else:
+        best = min(candidates, key=lambda m: _rank_otp_candidate(m, keywords))
+    return best.group().replace(' ', '-')
+
+#============================================
+# Poll Scheduler
+#============================================
+
+class AdaptiveScheduler:
+    # Decides how long a panel waits before its next poll from what the last
+    # poll produced: new messages -> drop to the minimum (a burst is likely to
+    # continue), nothing new -> grow by POLL_IDLE_BACKOFF, error -> grow by
+    # POLL_ERROR_BACKOFF per consecutive failure. While requests wait on
+    # /api/otp/<phone>?wait=, a panel that answers is held at the minimum (one
+    # that errors still backs off). Jitter keeps panels that share an upstream
+    # from polling in lockstep.
+    def __init__(self, base_interval):
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.failures = 0
+        self.idle_polls = 0
+        self.rate = 0.0  # EWMA of new messages per poll
+        self.decisions = deque(maxlen=10)
+    
+    def record(self, new_count, ok, waiting=False):
+        if waiting and ok:
+            self.failures = self.idle_polls = 0
+            interval, decision = POLL_MIN_INTERVAL, 'otp waiters'
+        elif not POLL_ADAPTIVE:
+            interval, decision = self.base_interval, 'fixed'
+        elif not ok:
+            # Grown from the last (capped) interval rather than as base * backoff **
+            # failures, which overflows after ~1000 failures of a dead panel
+            previous = self.interval if self.failures else self.base_interval
+            self.failures += 1
+            interval = previous * POLL_ERROR_BACKOFF
+            decision = f'error #{self.failures}'
+        elif new_count:
+            self.failures = self.idle_polls = 0
+            interval, decision = POLL_MIN_INTERVAL, f'burst ({new_count} new)'
+        else:
+            # Recovering from errors starts again from the configured interval
+            previous = self.base_interval if self.failures else self.interval
+            self.failures = 0
+            self.idle_polls += 1
+            interval, decision = previous * POLL_IDLE_BACKOFF, f'idle x{self.idle_polls}'
+        
+        self.rate = 0.7 * self.rate + 0.3 * new_count
+        self.interval = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, interval))
+        delay = self.interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        self.decisions.appendleft(f"{datetime.now().strftime('%H:%M:%S')} {decision} -> {delay:.1f}s")
+        return delay
+    
+    def stats(self):
+        return {
+            'interval': round(self.interval, 1),
+            'failures': self.failures,
+            'idle_polls': self.idle_polls,
+            'new_per_poll': round(self.rate, 2),
+            'decisions': list(self.decisions),
+        }
+
+#============================================
+# JSON Decoding
+#============================================
+
+# Panel responses are decoded straight from bytes with the fastest library
+# available; all three raise ValueError subclasses on bad input.
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+        JSON_BACKEND = 'ujson'
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = 'json'
+
+_json_decoder = json.JSONDecoder()
+_JSON_WS = ' \t\n\r'
+_JSON_DELIMITERS = _JSON_WS + ',:]}'
+MESSAGE_LIST_KEYS = ('sms', 'messages', 'data')
+
+
+def iter_json_messages(chunks):
+    # Incremental parser for the two response shapes the panel uses: a top-level
+    # list, or an object holding the list under one of MESSAGE_LIST_KEYS (the
+    # first such key in the body wins). Yields one decoded item at a time and
+    # raises ValueError on malformed or truncated input.
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    
+    def more():
+        nonlocal buf, pos
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + text.decode(chunk)
+                pos = 0
+                return True
+        return False
+    
+    def peek():
+        # Next non-whitespace character, reading more input as needed
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _JSON_WS:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not more():
+                raise ValueError('Unexpected end of JSON input')
+    
+    def value():
+        # A value only counts as complete once a delimiter follows it, so a number
+        # cut off at a chunk boundary ("2." of "2.5") is never taken for a shorter one
+        nonlocal pos
+        while True:
+            try:
+                obj, end = _json_decoder.raw_decode(buf, pos)
+                if end < len(buf) and buf[end] in _JSON_DELIMITERS:
+                    pos = end
+                    return obj
+            except ValueError:
+                pass
+            if not more():
+                obj, pos = _json_decoder.raw_decode(buf, pos)
+                return obj
+    
+    def items():
+        nonlocal pos
+        pos += 1  # '['
+        if peek() == ']':
+            pos += 1
+            return
+        while True:
+            peek()
+            yield value()
+            sep = peek()
+            pos += 1
+            if sep == ']':
+                return
+            if sep != ',':
+                raise ValueError(f'Expected , or ] in array, got {sep!r}')
+    
+    first = peek()
+    if first == '[':
+        yield from items()
+    elif first == '{':
+        pos += 1
+        while peek() != '}':
+            key = value()
+            if peek() != ':':
+                raise ValueError('Expected : after object key')
+            pos += 1
+            if peek() == '[' and key in MESSAGE_LIST_KEYS:
+                yield from items()
+                return
+            value()
+            if peek() == ',':
+                pos += 1
+    else:
+        raise ValueError('Response is neither a JSON list nor an object')
+
+#============================================
+# HTTP Transport
+#============================================
+
+# Time spent in connect() (DNS + TCP + TLS) by the current thread's request;
+# stays 0 when a pooled keep-alive connection was reused.
+_connect_timing = threading.local()
+
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, 'seconds', 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, 'seconds', 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def build_retry():
+    options = dict(
+        total=PANEL_RETRIES,
+        backoff_factor=PANEL_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    try:
+        return Retry(backoff_jitter=PANEL_RETRY_JITTER, retry_after_max=PANEL_RETRY_AFTER_MAX, **options)
+    except TypeError:
+        # Older urllib3 cannot cap Retry-After (the default cap is 6 hours, and a
+        # retry sleeps on the poll thread), so it is not honoured there
+        options['respect_retry_after_header'] = False
+    try:
+        return Retry(backoff_jitter=PANEL_RETRY_JITTER, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter
+        return Retry(**options)
+
+
+class PanelTransport:
+    # A requests.Session with a sized keep-alive pool, compressed responses and
+    # retries, that records where each request's time went: connect (incl. DNS
+    # and TLS), time to first byte and body download.
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = TimedHTTPAdapter(
+            pool_connections=PANEL_POOL_SIZE,
+            pool_maxsize=PANEL_POOL_SIZE,
+            max_retries=build_retry(),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self.timings = deque(maxlen=PANEL_TIMINGS_KEPT)
+    
+    def request(self, method, url, preload=True, **kwargs):
+        # preload=False leaves the body on the socket for the caller to stream;
+        # its download time is then not measured
+        _connect_timing.seconds = 0.0
+        start = time.perf_counter()
+        response = self.session.request(method, url, stream=True, **kwargs)
+        first_byte = time.perf_counter()
+        body = response.content if preload else None
+        done = time.perf_counter()
+        
+        connect = _connect_timing.seconds
+        self.timings.append({
+            'method': method,
+            'status': response.status_code,
+            'connect_ms': round(connect * 1000, 1),
+            'ttfb_ms': round((first_byte - start - connect) * 1000, 1),
+            'download_ms': round((done - first_byte) * 1000, 1) if preload else None,
+            'bytes': len(body) if preload else None,
+            'reused': connect == 0,
+        })
+        return response
+    
+    def stats(self):
+        timings = list(self.timings)
+        if not timings:
+            return {}
+        n = len(timings)
+        return {
+            'samples': n,
+            'avg_connect_ms': round(sum(t['connect_ms'] for t in timings) / n, 1),
+            'avg_ttfb_ms': round(sum(t['ttfb_ms'] for t in timings) / n, 1),
+            'avg_download_ms': round(sum(t['download_ms'] or 0 for t in timings) / n, 1),
+            'reused_pct': round(100 * sum(t['reused'] for t in timings) / n),
+            'last': timings[-1],
+        }
+
+#============================================
+# Circuit Breaker
+#============================================
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # closed -> open after `threshold` consecutive failures; open -> half-open
+    # once `reset_timeout` has passed, letting exactly one probe through; the
+    # probe's outcome closes or re-opens the circuit.
+    def __init__(self, threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.lock = threading.Lock()
+    
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half-open'
+            if self.state == 'half-open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probing = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+#============================================
+# Message Normalizer
+#============================================
+
+# Key spellings seen across panel builds, in priority order. CONTENT and
+# TIMESTAMP take the first key that is present; the others the first truthy one.
+CONTENT_KEYS = ('content', 'message', 'text')
+PHONE_KEYS = ('Number', 'number', 'phone')
+COUNTRY_KEYS = ('country', 'Country')
+SERVICE_KEYS = ('service', 'Service', 'sender')
+TIMESTAMP_KEYS = ('created_at', 'timestamp')
+ID_KEYS = ('id', '_id')
+DISPLAY_TIME_FORMAT = '%Y-%m-%d %I:%M %p'
+
+
+@functools.lru_cache(maxsize=4096)
+def _minute_stamp(prefix):
+    # 'YYYY-MM-DDTHH:MM' -> (epoch seconds, display string). Rows in a page share
+    # a handful of minutes, so this runs a few times per poll rather than per row.
+    dt = datetime.fromisoformat(prefix)
+    return dt.timestamp(), dt.strftime(DISPLAY_TIME_FORMAT)
+
+
+def parse_panel_time(value):
+    # Panel timestamps look like 2024-05-01T12:34:56[.fff][Z|+hh:mm]; like the old
+    # strptime call, only the first 19 characters are used, as local time.
+    # Returns (ts, display) or None when the value is not in that form.
+    text = value if isinstance(value, str) else str(value)
+    if len(text) < 19 or text[10] != 'T' or text[16] != ':':
+        return None
+    seconds = text[17:19]
+    if not seconds.isdigit() or seconds > '59':
+        return None
+    try:
+        ts, display = _minute_stamp(text[:16])
+    except ValueError:
+        return None
+    return ts + int(seconds), display
+
+
+def stable_message_id(phone, content, timestamp):
+    # Fallback for rows without id/_id. Unlike hash(), which is salted per
+    # process, this gives the same id in every worker and after a restart.
+    canonical = f"{phone or ''}|{content or ''}|{timestamp or ''}"
+    return hashlib.blake2b(canonical.encode('utf-8', 'surrogatepass'), digest_size=10).hexdigest()
+
+
+def _first_present(keys, default=''):
+    if not keys:
+        return lambda msg: default
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda msg: msg[key]
+    # A later spelling only wins when the earlier ones are absent from the row
+    def get(msg):
+        for key in keys:
+            if key in msg:
+                return msg[key]
+        return default
+    return get
+
+
+def _first_truthy(keys):
+    if not keys:
+        return lambda msg: None
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda msg: msg[key]
+    def get(msg):
+        for key in keys:
+            value = msg[key]
+            if value:
+                return value
+        return None
+    return get
+
+
+class MessageNormalizer:
+    # Works out once per payload shape (the row's key tuple) which spelling of
+    # each field the panel uses, and keeps the compiled accessors for the next
+    # rows and polls with the same shape.
+    def __init__(self, max_plans=64):
+        self.plans = {}
+        self.max_plans = max_plans
+    
+    def _compile(self, shape):
+        present = set(shape)
+        pick = lambda keys: tuple(k for k in keys if k in present)
+        plan = (
+            _first_present(pick(CONTENT_KEYS)),
+            _first_truthy(pick(PHONE_KEYS)),
+            _first_truthy(pick(COUNTRY_KEYS)),
+            _first_truthy(pick(SERVICE_KEYS)),
+            _first_present(pick(TIMESTAMP_KEYS)),
+            _first_present(pick(ID_KEYS), default=None),
+        )
+        if len(self.plans) >= self.max_plans:
+            self.plans.clear()
+        self.plans[shape] = plan
+        add_debug("🧩 New message schema: %s", list(shape), level=logging.DEBUG)
+        return plan
+    
+    def normalize(self, rows, source, id_prefix=''):
+        out = []
+        plans = self.plans
+        now = None
+        for msg in rows:
+            try:
+                shape = tuple(msg)
+                plan = plans.get(shape) or self._compile(shape)
+                get_content, get_phone, get_country, get_service, get_time, get_id = plan
+                
+                content = get_content(msg)
+                phone = get_phone(msg) or 'Unknown'
+                country_name = get_country(msg) or ''
+                service = get_service(msg) or detect_service(content)
+                
+                timestamp = get_time(msg)
+                msg_id = get_id(msg)
+                if msg_id is None:
+                    msg_id = stable_message_id(get_phone(msg), content, timestamp)
+                
+                stamp = parse_panel_time(timestamp) if timestamp else None
+                if stamp is None:
+                    if now is None:
+                        dt = datetime.now()
+                        now = (dt.timestamp(), dt.strftime(DISPLAY_TIME_FORMAT))
+                    stamp = now
+                
+                out.append({
+                    'otp': extract_otp(content),
+                    'phone': phone,
+                    'phone_masked': mask_phone_number(phone),
+                    'service': service,
+                    'country': country_name,
+                    'country_flag': country_flag(country_name),
+                    'timestamp': stamp[1],
+                    'ts': stamp[0],
+                    'raw_message': content[:200] if content else '',
+                    'source': source,
+                    'id': f"{id_prefix}{msg_id}" if id_prefix else msg_id
+                })
+            except Exception as e:
+                add_debug("❌ Format error: %s", str(e), level=logging.ERROR)
+                ERRORS.inc('format', type(e).__name__)
+        return out
+
+
 #============================================
 # API Scraper
 #============================================
 
 class PanelAPI:
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, name='default', interval=POLL_INTERVAL, id_prefix=''):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
         self.token = None
-        self.session = requests.Session()
+        self.transport = PanelTransport()
+        self.session = self.transport.session
         self.logged_in = False
         
+        # Per-panel schedule and health
+        self.name = name
+        self.interval = interval
+        self.id_prefix = id_prefix
+        self.next_poll = 0
+        self.last_poll = None
+        self.last_fetched = 0
+        self.status = 'Not initialized'
+        self.last_error = None
+        self.last_fetch_ok = False
+        self.scheduler = AdaptiveScheduler(interval)
+        self.login_lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+        
+        # High-water mark for incremental fetches
+        self.cursor = None
+        self.seen_ids = {}
+        self.normalizer = MessageNormalizer()
+        self.fetch_count = 0
+        
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 Chrome/120.0.0.0',
             'Accept': 'application/json',
             'Content-Type': 'application/json',
         })
     
+    def _request(self, method, url, preload=True, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"circuit open for {self.name}, retrying in up to {self.breaker.reset_timeout:.0f}s")
+        try:
+            response = self.transport.request(
+                method, url, preload=preload, timeout=(PANEL_CONNECT_TIMEOUT, PANEL_READ_TIMEOUT), **kwargs
+            )
+        except Exception:
+            # Any failure, including errors reading the body (ChunkedEncodingError,
+            # ContentDecodingError), must settle a half-open probe
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+    
     def login(self):
         try:
-            add_debug(f"🔐 Attempting login to {self.base_url}")
+            add_debug("🔐 Attempting login to %s", self.base_url)
             
-            response = self.session.post(
-                f"{self.base_url}/api/auth/login",
-                json={"username": self.username, "password": self.password},
-                timeout=15
-            )
+            with LOGIN_SECONDS.time(self.name):
+                response = self._request(
+                    'POST',
+                    f"{self.base_url}/api/auth/login",
+                    json={"username": self.username, "password": self.password}
+                )
+            return self._handle_login(response)
             
-            add_debug(f"📥 Login response status: {response.status_code}")
+        except Exception as e:
+            return self._login_error(e)
+    
+    def _handle_login(self, response):
+        # Shared with the asyncio runtime (asgi.py), whose responses have the
+        # same status_code/content/text attributes
+        add_debug("📥 Login response status: %s", response.status_code, level=logging.DEBUG)
+        
+        if response.status_code == 200:
+            data = json_loads(response.content)
+            if DEBUG_CAPTURE_PAYLOADS:
+                add_debug("📥 Login response: %s", Truncated(data, 200), level=logging.DEBUG)
             
-            if response.status_code == 200:
-                data = response.json()
-                add_debug(f"📥 Login response: {str(data)[:200]}")
-                
-                if 'token' in data:
-                    self.token = data['token']
-                    self.logged_in = True
-                    self.session.headers['Authorization'] = f'Bearer {self.token}'
-                    bot_stats['scraper_status'] = '✅ Connected'
-                    add_debug("✅ Login successful!")
-                    return True
-                else:
-                    add_debug(f"❌ No token in response: {data}")
+            if 'token' in data:
+                self.token = data['token']
+                self.logged_in = True
+                self.session.headers['Authorization'] = f'Bearer {self.token}'
+                self.status = '✅ Connected'
+                add_debug("✅ Login successful!")
+                return True
             else:
-                add_debug(f"❌ Login failed: {response.text[:200]}")
-            
-            bot_stats['scraper_status'] = '❌ Login failed'
-            return False
-            
-        except Exception as e:
-            add_debug(f"❌ Login error: {str(e)}")
-            bot_stats['scraper_status'] = f'❌ Error: {str(e)[:50]}'
-            bot_stats['last_error'] = str(e)
-            return False
+                add_debug("❌ No token in response: %s", Truncated(data, 200), level=logging.ERROR)
+        else:
+            add_debug("❌ Login failed: %s", response.text[:200], level=logging.ERROR)
+        
+        self.status = '❌ Login failed'
+        return False
+    
+    def _login_error(self, e):
+        add_debug("❌ Login error: %s", str(e), level=logging.ERROR)
+        ERRORS.inc('login', type(e).__name__)
+        self.status = f'❌ Error: {str(e)[:50]}'
+        self.last_error = bot_stats['last_error'] = str(e)
+        return False
+    
+    def ensure_login(self, stale_token=None):
+        # Only one thread logs in; the others wait for it and reuse its token.
+        # stale_token is the token a request was rejected with (401): if it has
+        # already been replaced there is nothing left to do.
+        with self.login_lock:
+            if self.logged_in and (stale_token is None or self.token != stale_token):
+                return True
+            self.logged_in = False
+            return self.login()
     
     def fetch_messages(self):
+        self.last_fetch_ok = False
         if not self.logged_in:
-            add_debug("⚠️ Not logged in, attempting login...")
-            if not self.login():
+            add_debug("⚠️ Not logged in, attempting login...", level=logging.WARNING)
+            if not self.ensure_login():
                 return []
         
         try:
-            url = f"{self.base_url}/api/sms?limit=100"
-            add_debug(f"📥 Fetching from: {url}")
-            
-            response = self.session.get(url, timeout=15)
-            add_debug(f"📥 Response status: {response.status_code}")
+            url, params = self._page_request()
+            token = self.token
+            streaming = FETCH_LIMIT >= STREAM_PARSE_MIN_LIMIT
+            with FETCH_SECONDS.time(self.name):
+                response = self._request('GET', url, params=params, preload=not streaming)
+            add_debug("📥 Response status: %s", response.status_code, level=logging.DEBUG)
             
             if response.status_code == 401:
-                add_debug("⚠️ Token expired, re-logging in...")
-                self.logged_in = False
-                if not self.login():
+                add_debug("⚠️ Token expired, re-logging in...", level=logging.WARNING)
+                response.close()
+                RELOGINS.inc(self.name)
+                if not self.ensure_login(stale_token=token):
                     return []
-                response = self.session.get(url, timeout=15)
+                with FETCH_SECONDS.time(self.name):
+                    response = self._request('GET', url, params=params, preload=not streaming)
             
             if response.status_code != 200:
-                add_debug(f"❌ Failed to fetch: {response.status_code}")
-                add_debug(f"Response: {response.text[:300]}")
+                add_debug("❌ Failed to fetch: %s", response.status_code, level=logging.ERROR)
+                if DEBUG_CAPTURE_PAYLOADS:
+                    add_debug("Response: %s", response.text[:300], level=logging.ERROR)
+                response.close()
                 return []
             
-            # حفظ الـ response للـ debug
-            raw_data = response.text
-            bot_stats['api_response'] = raw_data[:1000]
-            add_debug(f"📥 Raw response: {raw_data[:300]}")
+            return self._read_page(response, streaming)
+            
+        except Exception as e:
+            return self._fetch_error(e)
+    
+    def _page_request(self):
+        url = f"{self.base_url}/api/sms"
+        params = {'limit': FETCH_LIMIT}
+        if INCREMENTAL_FETCH and PANEL_SINCE_PARAM and self.cursor is not None:
+            params[PANEL_SINCE_PARAM] = self.cursor
+        add_debug("📥 Fetching from: %s %s", url, params, level=logging.DEBUG)
+        return url, params
+    
+    def _read_page(self, response, streaming=False):
+        # Decodes a 200 response down to the new, formatted messages. Shared with
+        # the asyncio runtime (asgi.py), which always passes a fully read body.
+        parse_start = time.perf_counter()
+        
+        # حفظ الـ response للـ debug (عينة فقط)
+        capture = DEBUG_CAPTURE_PAYLOADS and self.fetch_count % DEBUG_PAYLOAD_EVERY == 0
+        self.fetch_count += 1
+        
+        if streaming:
+            # Items are decoded one at a time straight off the socket, so the
+            # whole body never sits in memory next to the decoded list
+            add_debug("📥 Streaming response (limit %s)", FETCH_LIMIT, level=logging.DEBUG)
+            messages = iter_json_messages(response.iter_content(STREAM_CHUNK_SIZE))
+        else:
+            body = response.content
+            if capture:
+                # memoryview: slicing does not copy the body, only the sample is decoded
+                sample = memoryview(body)[:1000]
+                bot_stats['api_response'] = str(sample, 'utf-8', 'ignore')
+                add_debug("📥 Raw response: %s", str(sample[:300], 'utf-8', 'ignore'), level=logging.DEBUG)
             
             try:
-                data = response.json()
-            except:
-                add_debug(f"❌ Invalid JSON response")
+                data = json_loads(body)
+            except ValueError as e:
+                add_debug("❌ Invalid JSON response", level=logging.ERROR)
+                ERRORS.inc('parse', type(e).__name__)
                 return []
             
             # معرفة نوع الـ response
-            add_debug(f"📥 Response type: {type(data)}")
+            add_debug("📥 Response type: %s", type(data), level=logging.DEBUG)
             
             if isinstance(data, list):
                 messages = data
-                add_debug(f"📥 Response is a list with {len(messages)} items")
+                add_debug("📥 Response is a list with %s items", len(messages), level=logging.DEBUG)
             elif isinstance(data, dict):
-                add_debug(f"📥 Response keys: {list(data.keys())}")
+                add_debug("📥 Response keys: %s", list(data), level=logging.DEBUG)
                 messages = data.get('sms', data.get('messages', data.get('data', [])))
-                add_debug(f"📥 Extracted {len(messages)} messages")
+                add_debug("📥 Extracted %s messages", len(messages), level=logging.DEBUG)
             else:
-                add_debug(f"❌ Unknown response type: {type(data)}")
+                add_debug("❌ Unknown response type: %s", type(data), level=logging.ERROR)
                 messages = []
-            
-            if messages and len(messages) > 0:
-                add_debug(f"📨 First message sample: {json.dumps(messages[0], ensure_ascii=False)[:300]}")
-            
-            formatted = []
+        
+        rows = []
+        new_ids = []
+        newest = None
+        try:
             for i, m in enumerate(messages):
-                f = self._format_message(m)
-                if f:
-                    formatted.append(f)
-                    if i == 0:
-                        add_debug(f"✅ Formatted first message: {f.get('otp')} - {f.get('service')}")
-            
-            add_debug(f"📨 Total formatted: {len(formatted)}")
-            return formatted
-            
-        except Exception as e:
-            add_debug(f"❌ Fetch error: {str(e)}")
-            bot_stats['last_error'] = str(e)
+                if not isinstance(m, dict):
+                    add_debug("❌ Format error: unexpected row %s", Truncated(m, 100), level=logging.ERROR)
+                    continue
+                raw_id = self._raw_id(m)
+                if i == 0:
+                    newest = m.get(PANEL_CURSOR_FIELD)
+                    if capture:
+                        add_debug("📨 First message sample: %s", Truncated(m, 300, as_json=True), level=logging.DEBUG)
+                if INCREMENTAL_FETCH and raw_id in self.seen_ids:
+                    # Everything below this row was already parsed on a previous poll
+                    add_debug("⏭️ Reached already-seen message after %s new rows", i, level=logging.DEBUG)
+                    break
+                if raw_id is not None:
+                    new_ids.append(raw_id)
+                rows.append(m)
+        except ValueError as e:
+            add_debug("❌ Invalid JSON response", level=logging.ERROR)
+            ERRORS.inc('parse', type(e).__name__)
             return []
-    
-    def _format_message(self, msg):
-        try:
-            content = msg.get('content', msg.get('message', msg.get('text', '')))
-            otp = self._extract_otp(content)
-            
-            phone = msg.get('Number') or msg.get('number') or msg.get('phone') or 'Unknown'
-            country_name = msg.get('country') or msg.get('Country') or ''
-            country_flag = self._get_country_flag(country_name)
-            
-            service = (
-                msg.get('service') or 
-                msg.get('Service') or
-                msg.get('sender') or 
-                self._detect_service(content)
-            )
-            
-            timestamp = msg.get('created_at', msg.get('timestamp', ''))
-            if timestamp:
-                try:
-                    dt = datetime.strptime(str(timestamp)[:19], '%Y-%m-%dT%H:%M:%S')
-                    timestamp = dt.strftime('%Y-%m-%d %I:%M %p')
-                except:
-                    timestamp = datetime.now().strftime('%Y-%m-%d %I:%M %p')
-            else:
-                timestamp = datetime.now().strftime('%Y-%m-%d %I:%M %p')
-            
-            return {
-                'otp': otp,
-                'phone': phone,
-                'phone_masked': mask_phone_number(phone),
-                'service': service,
-                'country': country_name,
-                'country_flag': country_flag,
-                'timestamp': timestamp,
-                'raw_message': content[:200] if content else '',
-                'id': msg.get('id', msg.get('_id', str(hash(str(msg)))))
-            }
-        except Exception as e:
-            add_debug(f"❌ Format error: {str(e)}")
-            return None
-    
-    def _extract_otp(self, content):
-        if not content:
-            return 'N/A'
+        finally:
+            if streaming:
+                response.close()
+        PARSE_SECONDS.observe(time.perf_counter() - parse_start, self.name)
         
-        patterns = [
-            r'(\d{3}[-\s]?\d{3})',
-            r'(\d{4}[-\s]?\d{4})',
-            r'(?:code|kode|otp)[:\s]*(\d{4,8})',
-            r'(\d{6})',
-            r'(\d{4,8})',
-        ]
+        with NORMALIZE_SECONDS.time(self.name):
+            formatted = self.normalizer.normalize(rows, self.name, self.id_prefix)
+        if formatted:
+            add_debug("✅ Formatted first message: %s - %s", formatted[0]['otp'], formatted[0]['service'], level=logging.DEBUG)
         
-        for pattern in patterns:
-            match = re.search(pattern, content, re.I)
-            if match:
-                return match.group(1).replace(' ', '-')
-        return 'N/A'
+        self._advance_cursor(new_ids, newest)
+        self.last_fetch_ok = True
+        
+        add_debug("📨 Total formatted: %s", len(formatted), level=logging.DEBUG)
+        return formatted
+
+    def _fetch_error(self, e):
+        add_debug("❌ Fetch error: %s", str(e), level=logging.ERROR)
+        ERRORS.inc('fetch', type(e).__name__)
+        self.last_error = bot_stats['last_error'] = str(e)
+        return []
     
-    def _detect_service(self, content):
-        if not content:
-            return 'Unknown'
-        
-        services = {
-            'whatsapp': 'WhatsApp', 'telegram': 'Telegram',
-            'facebook': 'Facebook', 'instagram': 'Instagram',
-            'twitter': 'Twitter', 'google': 'Google',
-            'tiktok': 'TikTok', 'snapchat': 'Snapchat',
-        }
-        
-        content_lower = content.lower()
-        for key, name in services.items():
-            if key in content_lower:
-                return name
-        return 'SMS Service'
-    
-    def _get_country_flag(self, country):
-        if not country:
-            return '🌍'
-        country_lower = country.lower().strip()
-        if country_lower in COUNTRY_FLAGS:
-            return COUNTRY_FLAGS[country_lower]
-        for key, flag in COUNTRY_FLAGS.items():
-            if key in country_lower:
-                return flag
-        return '🌍'
+    def _advance_cursor(self, new_ids, newest):
+        # The ids on the newest page: the new rows, then the previously seen ones
+        # that the break skipped over (the panel returns newest first)
+        seen = dict.fromkeys(new_ids)
+        for msg_id in self.seen_ids:
+            if len(seen) >= FETCH_LIMIT:
+                break
+            seen.setdefault(msg_id)
+        self.seen_ids = seen
+        if newest is not None:
+            self.cursor = newest
+    
+    @staticmethod
+    def _raw_id(msg):
+        if not isinstance(msg, dict):
+            return None
+        return msg.get('id', msg.get('_id'))
+
 
+def load_panel_configs():
+    if os.environ.get('PANELS'):
+        return json.loads(os.environ['PANELS'])
+    if PANELS_FILE and os.path.exists(PANELS_FILE):
+        with open(PANELS_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    return [{'name': 'default', 'url': PANEL_URL, 'username': PANEL_USERNAME, 'password': PANEL_PASSWORD}]
 
-def create_scraper():
+
+def create_scrapers():
     try:
-        add_debug("🔧 Creating scraper...")
-        api = PanelAPI(PANEL_URL, PANEL_USERNAME, PANEL_PASSWORD)
-        if api.login():
-            add_debug("✅ Scraper ready")
-        return api
+        add_debug("🔧 Creating scrapers...")
+        configs = load_panel_configs()
+        # Ids from different panels can collide, so namespace them by panel
+        multi = len(configs) > 1
+        apis = []
+        for config in configs:
+            name = config.get('name') or config['url']
+            apis.append(PanelAPI(
+                config['url'], config['username'], config['password'],
+                name=name,
+                interval=config.get('interval', POLL_INTERVAL),
+                id_prefix=f"{name}:" if multi else ''
+            ))
+        add_debug("✅ %s scraper(s) ready: %s", len(apis), ', '.join(api.name for api in apis))
+        return apis
     except Exception as e:
-        add_debug(f"❌ Scraper error: {str(e)}")
+        add_debug("❌ Scraper error: %s", str(e), level=logging.ERROR)
         return None
 
 #============================================
 # OTP Filter
 #============================================
 
+class BloomFilter:
+    # Two generations of `capacity` items each: when the current one is full the
+    # older one is dropped, so memory stays fixed and recent ids are always covered.
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.current = bytearray((self.num_bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+    
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, key):
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+        for pos in self._positions(key):
+            self.current[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    
+    def __contains__(self, key):
+        positions = self._positions(key)
+        return any(
+            all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+            for bits in (self.current, self.previous)
+        )
+    
+    def clear(self):
+        self.current = bytearray(len(self.current))
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+
+
 class OTPFilter:
-    def __init__(self):
-        self.cache = set()
+    def __init__(self, max_size=0, ttl=0, bloom_capacity=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # msg_id -> first seen (monotonic), oldest first
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity else None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
     
     def is_new(self, msg_id):
-        if msg_id in self.cache:
-            return False
-        self.cache.add(msg_id)
-        return True
+        with self.lock:
+            now = time.monotonic()
+            self._evict(now)
+            if msg_id in self.cache or (self.bloom is not None and msg_id in self.bloom):
+                self.hits += 1
+                return False
+            self.misses += 1
+            self.cache[msg_id] = now
+            self._evict(now)
+            return True
+    
+    def _evict(self, now):
+        while self.cache:
+            msg_id, seen = next(iter(self.cache.items()))
+            expired = self.ttl and now - seen > self.ttl
+            if not expired and not (self.max_size and len(self.cache) > self.max_size):
+                break
+            self.cache.popitem(last=False)
+            self.evictions += 1
+            if self.bloom is not None:
+                self.bloom.add(msg_id)
     
     def clear(self):
-        self.cache.clear()
+        with self.lock:
+            self.cache.clear()
+            if self.bloom is not None:
+                self.bloom.clear()
+    
+    def stats(self):
+        return {
+            'size': len(self.cache),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bloom_bytes': len(self.bloom.current) * 2 if self.bloom else 0,
+        }
 
-otp_filter = OTPFilter()
+otp_filter = OTPFilter(DEDUP_MAX_SIZE, DEDUP_TTL, DEDUP_BLOOM_CAPACITY)
 
 #============================================
-# Background Monitor
+# Message Store
 #============================================
 
-def check_and_update():
-    global scraper, all_messages
+class MessageStore:
+    # Fixed-capacity ring buffer of formatted messages. Appending overwrites the
+    # oldest slot in O(1) and keeps secondary indexes in step. Readers get an
+    # immutable tuple (newest first) that is rebuilt at most once per write.
+    #
+    # `version` only ever goes up: every stored message gets the next number, and
+    # bump() marks a change that has no message (stats updated by a poll), so
+    # clients can ask for "what changed since version N".
+    #
+    # Indexes map a key to {seq: message} (in insertion order, so oldest first);
+    # by_ts and phone_keys are kept sorted for range and prefix lookups.
+    INDEXES = {
+        'phone': lambda msg: phone_key(msg.get('phone')),
+        'service': lambda msg: msg.get('service'),
+        'country': lambda msg: msg.get('country'),
+        'has_otp': lambda msg: msg.get('otp') not in (None, '', 'N/A'),
+    }
+    LOOKUP_KEYS = {'phone': phone_key}  # how a looked-up value is normalised
     
-    try:
-        add_debug("🔄 Starting check...")
-        
-        if not scraper:
-            add_debug("⚠️ No scraper, creating...")
-            scraper = create_scraper()
-            if not scraper:
-                add_debug("❌ Failed to create scraper")
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.version = 0
+        self.cleared_at = 0
+        self.epoch = f"{time.time_ns():x}"  # tells this process's versions apart in ETags
+        self.stats_key = None
+        self._reset()
+    
+    def _reset(self):
+        self.slots = [None] * self.capacity
+        self.seqs = [0] * self.capacity
+        self.head = 0
+        self.size = 0
+        self.by_seq = {}
+        self.by_ts = []  # sorted (ts, seq)
+        self.phone_keys = []  # sorted keys of indexes['phone']
+        self.indexes = {field: {} for field in self.INDEXES}
+        self._snapshot = ()
+    
+    def clear(self):
+        with self.lock:
+            self._reset()
+            self.version += 1
+            self.cleared_at = self.version
+    
+    def bump(self, stats_key):
+        # Moves the version for a change in the stats served next to the
+        # messages; a poll that changed nothing keeps the ETag, so it still 304s
+        with self.lock:
+            if stats_key == self.stats_key:
+                return False
+            self.stats_key = stats_key
+            self.version += 1
+            return True
+    
+    def cursor(self, version=None):
+        return f"{self.epoch}.{self.version if version is None else version}"
+    
+    def parse_cursor(self, value):
+        # A cursor handed out as 'version' / ETag -> version, or None when it is
+        # missing, malformed or from another epoch (another poller, or before a
+        # restart). A bare number is taken as a version of this epoch.
+        if not value:
+            return None
+        epoch, _, version = value.strip('"').rpartition('.')
+        if epoch and epoch != self.epoch:
+            return None
+        try:
+            return int(version)
+        except ValueError:
+            return None
+    
+    def __len__(self):
+        return self.size
+    
+    def add_many(self, messages):
+        with self.lock:
+            for msg in messages:
+                evicted = self.slots[self.head]
+                if evicted is not None:
+                    self._unindex(evicted, self.seqs[self.head])
+                self.version += 1
+                self.slots[self.head] = msg
+                self.seqs[self.head] = self.version
+                self.head = (self.head + 1) % self.capacity
+                self.size = min(self.size + 1, self.capacity)
+                self._index(msg, self.version)
+            if messages:
+                self._snapshot = None
+    
+    def add(self, msg):
+        self.add_many([msg])
+    
+    def _key(self, field, value):
+        normalise = self.LOOKUP_KEYS.get(field)
+        return normalise(value) if normalise else value
+    
+    def _index(self, msg, seq):
+        self.by_seq[seq] = msg
+        bisect.insort(self.by_ts, (msg.get('ts') or 0, seq))
+        for field, key_of in self.INDEXES.items():
+            key = key_of(msg)
+            bucket = self.indexes[field].get(key)
+            if bucket is None:
+                bucket = self.indexes[field][key] = {}
+                if field == 'phone' and isinstance(key, str):
+                    bisect.insort(self.phone_keys, key)
+            bucket[seq] = msg
+    
+    def _unindex(self, msg, seq):
+        del self.by_seq[seq]
+        entry = (msg.get('ts') or 0, seq)
+        i = bisect.bisect_left(self.by_ts, entry)
+        if i < len(self.by_ts) and self.by_ts[i] == entry:
+            del self.by_ts[i]
+        for field, key_of in self.INDEXES.items():
+            key = key_of(msg)
+            bucket = self.indexes[field].get(key)
+            if bucket and bucket.pop(seq, None) is not None and not bucket:
+                del self.indexes[field][key]
+                if field == 'phone' and isinstance(key, str):
+                    i = bisect.bisect_left(self.phone_keys, key)
+                    if i < len(self.phone_keys) and self.phone_keys[i] == key:
+                        del self.phone_keys[i]
+    
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.versioned_snapshot()[1]
+        return snapshot
+    
+    def versioned_snapshot(self):
+        # (version, snapshot) from the same moment: a body built from them never
+        # carries a version newer than its messages, which a ?since= client
+        # would otherwise skip past
+        with self.lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(
+                    self.slots[(self.head - 1 - i) % self.capacity]
+                    for i in range(self.size)
+                )
+            return self.version, self._snapshot
+    
+    def since(self, version):
+        # Returns (current version, messages newer than `version` newest first,
+        # full). `full` means the client's copy is unusable (the store was cleared
+        # or the version comes from another process) and it got everything instead.
+        with self.lock:
+            full = version < self.cleared_at or version > self.version
+            newer = []
+            for i in range(self.size):
+                slot = (self.head - 1 - i) % self.capacity
+                if not full and self.seqs[slot] <= version:
+                    break
+                newer.append(self.slots[slot])
+            return self.version, newer, full
+    
+    def export(self):
+        with self.lock:
+            entries = [
+                [self.seqs[(self.head - self.size + i) % self.capacity],
+                 self.slots[(self.head - self.size + i) % self.capacity]]
+                for i in range(self.size)
+            ]
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'cleared_at': self.cleared_at,
+                'entries': entries,
+            }
+    
+    def load(self, data):
+        with self.lock:
+            self._reset()
+            for seq, msg in data['entries'][-self.capacity:]:
+                self.slots[self.head] = msg
+                self.seqs[self.head] = seq
+                self.head = (self.head + 1) % self.capacity
+                self.size += 1
+                self._index(msg, seq)
+            self.epoch = data['epoch']
+            self.version = data['version']
+            self.cleared_at = data['cleared_at']
+            self._snapshot = None
+    
+    def latest(self, field, value, received_after=0):
+        # Newest message in an index bucket that was stored after
+        # `received_after` (unix time). Newest by panel ts, then by poll; within
+        # one poll's batch the first row is the newest, and batches go in
+        # newest first, so there the lower seq wins.
+        with self.lock:
+            bucket = self.indexes[field].get(self._key(field, value), {})
+            candidates = [
+                (msg['ts'], msg.get('received_at', 0), -seq, msg)
+                for seq, msg in bucket.items()
+                if msg.get('received_at', 0) > received_after
+            ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda entry: entry[:3])[3]
+    
+    def query(self, filters, start=None, end=None, after=None, before=None, limit=50):
+        # Messages matching every filter, newest first, and the cursor for the
+        # next page (None on the last one). `filters` holds exact index values
+        # (service, country, has_otp) and an optional phone prefix; start/end
+        # bound ts (end exclusive), after/before bound seq (both exclusive).
+        with self.lock:
+            candidates = []
+            for field in ('service', 'country', 'has_otp'):
+                if field in filters:
+                    candidates.append(self.indexes[field].get(filters[field], {}))
+            prefix = filters.get('phone')
+            if prefix is not None:
+                prefix = phone_key(prefix) or ''
+                lo = bisect.bisect_left(self.phone_keys, prefix)
+                hi = bisect.bisect_left(self.phone_keys, prefix + '\U0010ffff')
+                matched = {}
+                for key in self.phone_keys[lo:hi]:
+                    matched.update(self.indexes['phone'][key])
+                candidates.append(matched)
+            if start is not None or end is not None:
+                lo = 0 if start is None else bisect.bisect_left(self.by_ts, (start,))
+                hi = len(self.by_ts) if end is None else bisect.bisect_left(self.by_ts, (end,))
+                candidates.append(dict.fromkeys(seq for _, seq in self.by_ts[lo:hi]))
+            
+            if candidates:
+                # Walk the smallest set, probe the others
+                candidates.sort(key=len)
+                seqs = [seq for seq in candidates[0] if all(seq in other for other in candidates[1:])]
+            else:
+                seqs = self.by_seq
+            seqs = heapq.nlargest(limit + 1, (
+                seq for seq in seqs
+                if (after is None or seq > after) and (before is None or seq < before)
+            ))
+            page = [self.by_seq[seq] for seq in seqs[:limit]]
+            cursor = seqs[limit - 1] if len(seqs) > limit else None
+            return page, cursor
+
+message_store = MessageStore(MAX_MESSAGES)
+
+#============================================
+# OTP Waiters
+#============================================
+
+class OTPWaiters:
+    # Requests blocked on "the next message for this number", keyed like the
+    # store's phone index. A waiter is a parked Event, so idle waiters cost no
+    # CPU, and a new message wakes only the waiters for its own number. `since`
+    # is compared with received_at, the server's clock when the message was
+    # stored, not the panel's whole-second, local-time ts.
+    def __init__(self):
+        self.waiting = {}  # phone key -> list of [event, since, message]
+        self.lock = threading.Lock()
+        self.hurried = float('-inf')
+    
+    def wait(self, phone, since, timeout):
+        # Registered before the store is checked, so a message landing in between
+        # is caught by one or the other
+        waiter = [threading.Event(), since, None]
+        key = phone_key(phone)
+        with self.lock:
+            self.waiting.setdefault(key, []).append(waiter)
+        try:
+            msg = message_store.latest('phone', phone, since)
+            if msg is not None:
+                return msg
+            if timeout > 0:
+                hurry_poll()
+            if shared_state and not shared_state.is_poller:
+                # The poller cannot see waiters in this worker, so keep asking
+                # for a poll every POLL_MIN_INTERVAL while this one waits
+                deadline = time.monotonic() + timeout
+                while not waiter[0].wait(min(POLL_MIN_INTERVAL, max(deadline - time.monotonic(), 0))):
+                    if time.monotonic() >= deadline:
+                        break
+                    hurry_poll()
+            else:
+                waiter[0].wait(timeout)
+            return waiter[2]
+        finally:
+            with self.lock:
+                waiters = self.waiting.get(key)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self.waiting[key]
+    
+    def notify(self, messages):
+        if not self.waiting:
+            return
+        with self.lock:
+            for msg in messages:
+                waiters = self.waiting.get(phone_key(msg.get('phone')))
+                if not waiters:
+                    continue
+                for waiter in waiters:
+                    if waiter[2] is None and msg['received_at'] > waiter[1]:
+                        waiter[2] = msg
+                        waiter[0].set()
+    
+    def __len__(self):
+        return sum(len(waiters) for waiters in list(self.waiting.values()))
+    
+    def __bool__(self):
+        return bool(self.waiting)
+
+otp_waiters = OTPWaiters()
+# Everything holding /api/otp waiters; while any is non-empty, panels are polled
+# at POLL_MIN_INTERVAL. The asyncio runtime adds its own.
+otp_wait_pools = [otp_waiters]
+
+
+def hurry_poll():
+    # Polls right away for a new waiter (at most once per POLL_MIN_INTERVAL, so a
+    # crowd of waiters is one poll)
+    now = time.monotonic()
+    if now - otp_waiters.hurried < POLL_MIN_INTERVAL:
+        return
+    otp_waiters.hurried = now
+    if shared_state and not shared_state.is_poller:
+        shared_state.request('refresh')
+    else:
+        poll_wakeup.set()
+
+#============================================
+# Message History (SQLite)
+#============================================
+
+class MessageHistory:
+    # Append-only store of every message, in WAL mode so the poller can write
+    # while any number of workers read. Pages are keyset-paginated on (ts, id)
+    # so each query walks an index instead of scanning or using OFFSET.
+    # filter -> (column, how the filter value is normalised); phone matches on
+    # digits only, like the live store's phone index
+    FILTERS = {
+        'phone': ('phone_key', phone_key),
+        'service': ('service', None),
+        'country': ('country', None),
+    }
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            ts REAL NOT NULL,
+            phone TEXT,
+            phone_key TEXT,
+            service TEXT,
+            country TEXT,
+            otp TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (ts, id);
+        CREATE INDEX IF NOT EXISTS idx_messages_service ON messages (service, ts, id);
+        CREATE INDEX IF NOT EXISTS idx_messages_country ON messages (country, ts, id);
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        self._migrate(conn)
+    
+    def _migrate(self, conn):
+        # Databases from before phone_key: add and backfill the column, and swap
+        # the raw phone index for one on the key
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+        with conn:
+            if 'phone_key' not in columns:
+                conn.create_function('digits_only', 1, phone_key, deterministic=True)
+                conn.execute('ALTER TABLE messages ADD COLUMN phone_key TEXT')
+                conn.execute('UPDATE messages SET phone_key = digits_only(phone)')
+            conn.execute('DROP INDEX IF EXISTS idx_messages_phone')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_phone_key ON messages (phone_key, ts, id)')
+    
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+    
+    def add_many(self, messages):
+        if not messages:
+            return
+        rows = [
+            (str(m['id']), m['ts'], m.get('phone'), phone_key(m.get('phone')), m.get('service'),
+             m.get('country'), m.get('otp'), json.dumps(m, ensure_ascii=False, default=str))
+            for m in messages
+        ]
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO messages (id, ts, phone, phone_key, service, country, otp, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+    
+    def page(self, filters, before=None, limit=50):
+        # Returns (messages newest first, cursor for the next page or None)
+        clauses, params = [], []
+        for field, (column, normalise) in self.FILTERS.items():
+            if filters.get(field):
+                clauses.append(f'{column} = ?')
+                params.append(normalise(filters[field]) if normalise else filters[field])
+        if before:
+            ts, _, msg_id = before.partition(':')
+            clauses.append('(ts, id) < (?, ?)')
+            params.extend([float(ts), msg_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f'SELECT ts, id, data FROM messages {where} ORDER BY ts DESC, id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        cursor = f"{rows[-1][0]!r}:{rows[-1][1]}" if len(rows) == limit else None
+        return [json.loads(row[2]) for row in rows], cursor
+    
+    def recent_ids(self, limit):
+        # Oldest first, so the newest ids are the last to age out of a bounded filter
+        rows = self._connection().execute(
+            'SELECT id FROM messages ORDER BY ts DESC, id DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+message_history = MessageHistory(HISTORY_DB) if HISTORY_DB else None
+
+#============================================
+# Live Events (SSE)
+#============================================
+
+class EventBroadcaster:
+    # Each event is serialised once and handed to every open /api/stream. A viewer
+    # whose queue fills up is disconnected; the page reloads when it reconnects.
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.lock = threading.Lock()
+    
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add(q)
+        return q
+    
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+    
+    def publish(self, event, data):
+        with self.lock:
+            if not self.subscribers:
                 return
-        
-        if not scraper.logged_in:
-            add_debug("⚠️ Not logged in, logging in...")
-            if not scraper.login():
-                add_debug("❌ Login failed")
+            subscribers = list(self.subscribers)
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+        for q in subscribers:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(None)
+    
+    def stream(self):
+        q = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    payload = q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if payload is None:
+                    return
+                yield payload
+        finally:
+            self.unsubscribe(q)
+
+live_events = EventBroadcaster(SSE_QUEUE_SIZE)
+
+
+def visible_stats():
+    # What the dashboard and /api/messages show of bot_stats, minus the fields
+    # that tick on every poll (last_check, last_poll, timings, the schedule);
+    # live viewers still get those through the 'stats' event
+    return (
+        bot_stats['total_otps'], bot_stats['is_running'], bot_stats['scraper_status'],
+        bot_stats['last_error'], bot_stats['api_response'],
+        tuple((name, panel['status'], panel['last_fetched'], panel['last_error'], panel['circuit'])
+              for name, panel in bot_stats['panels'].items()),
+    )
+
+
+def publish_stats():
+    live_events.publish('stats', {
+        'total_otps': bot_stats['total_otps'],
+        'last_check': bot_stats['last_check'],
+        'count': len(message_store),
+    })
+
+#============================================
+# Webhooks
+#============================================
+
+def load_webhook_configs():
+    if os.environ.get('WEBHOOKS'):
+        return json.loads(os.environ['WEBHOOKS'])
+    if WEBHOOKS_FILE and os.path.exists(WEBHOOKS_FILE):
+        with open(WEBHOOKS_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+
+class Webhook:
+    def __init__(self, url, service=None, country=None, phone=None, headers=None):
+        self.url = url
+        self.service = service
+        self.country = country
+        self.phone = phone_key(phone) if phone else None
+        self.headers = headers or {}
+    
+    def matches(self, msg):
+        if self.service and msg.get('service') != self.service:
+            return False
+        if self.country and msg.get('country') != self.country:
+            return False
+        if self.phone and not str(phone_key(msg.get('phone')) or '').startswith(self.phone):
+            return False
+        return True
+
+
+class WebhookDispatcher:
+    # publish() only matches and enqueues, so the poll loop never waits on a
+    # receiver. A single collector thread takes a message, gives the burst
+    # WEBHOOK_BATCH_WAIT seconds to fill and hands one batch per hook to the
+    # delivery pool, which sends it as one POST: {"messages": [...]}. At most
+    # WEBHOOK_WORKERS batches are in flight; past that the queue fills and drops.
+    # Retries back off in the pool, never in the poller.
+    def __init__(self, hooks):
+        self.hooks = hooks
+        self.queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(hooks), 1), pool_maxsize=WEBHOOK_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = None
+        self.slots = threading.BoundedSemaphore(WEBHOOK_WORKERS)
+        self.started = False
+        self.start_lock = threading.Lock()
+    
+    def _start(self):
+        with self.start_lock:
+            if self.started:
                 return
+            self.pool = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='webhook')
+            threading.Thread(target=self._work, name='webhook-collector', daemon=True).start()
+            self.started = True
+    
+    def publish(self, messages):
+        if not self.hooks or not messages:
+            return
+        if not self.started:
+            self._start()
+        now = time.monotonic()
+        for msg in messages:
+            for hook in self.hooks:
+                if not hook.matches(msg):
+                    continue
+                try:
+                    self.queue.put_nowait((hook, msg, now))
+                except queue.Full:
+                    WEBHOOK_DROPS.inc('queue_full')
+    
+    def _collect(self):
+        items = [self.queue.get()]
+        deadline = time.monotonic() + WEBHOOK_BATCH_WAIT
+        while len(items) < WEBHOOK_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+    
+    def _work(self):
+        while True:
+            batches = {}
+            for hook, msg, queued in self._collect():
+                batches.setdefault(hook, []).append((msg, queued))
+            for hook, batch in batches.items():
+                self.slots.acquire()
+                self.pool.submit(self._send, hook, batch)
+    
+    def _send(self, hook, batch):
+        try:
+            self._deliver(hook, batch)
+        except Exception as e:
+            add_debug("❌ Webhook error (%s): %s", hook.url, str(e), level=logging.ERROR)
+            ERRORS.inc('webhook', type(e).__name__)
+        finally:
+            self.slots.release()
+    
+    def _deliver(self, hook, batch):
+        body = json.dumps({'messages': [msg for msg, _ in batch]}, ensure_ascii=False, default=str).encode('utf-8')
+        headers = {'Content-Type': 'application/json', **hook.headers}
+        for attempt in range(WEBHOOK_RETRIES + 1):
+            if attempt:
+                WEBHOOK_RETRIES_TOTAL.inc()
+                time.sleep(WEBHOOK_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                response = self.session.post(hook.url, data=body, headers=headers, timeout=WEBHOOK_TIMEOUT)
+            except requests.RequestException as e:
+                error = type(e).__name__
+            else:
+                if response.status_code < 400:
+                    done = time.monotonic()
+                    for _, queued in batch:
+                        WEBHOOK_LATENCY.observe(done - queued)
+                    WEBHOOK_DELIVERIES.inc('ok', amount=len(batch))
+                    return
+                error = f'HTTP {response.status_code}'
+                if response.status_code < 500 and response.status_code != 429:
+                    break  # the receiver rejected it; resending will not help
+        add_debug("❌ Webhook %s gave up on %s message(s): %s", hook.url, len(batch), error, level=logging.ERROR)
+        WEBHOOK_DELIVERIES.inc('failed', amount=len(batch))
+    
+    def stats(self):
+        return {'hooks': len(self.hooks), 'queued': self.queue.qsize(), 'workers': WEBHOOK_WORKERS if self.started else 0}
+
+
+def create_webhooks():
+    try:
+        hooks = [Webhook(**config) for config in load_webhook_configs()]
+    except Exception as e:
+        add_debug("❌ Webhook config error: %s", str(e), level=logging.ERROR)
+        hooks = []
+    if hooks:
+        add_debug("🔔 %s webhook(s): %s", len(hooks), ', '.join(hook.url for hook in hooks))
+    return WebhookDispatcher(hooks)
+
+webhooks = create_webhooks()
+
+#============================================
+# Background Monitor
+#============================================
+
+# Called with each batch of new messages, straight after they are stored
+message_listeners = []
+
+poll_executor = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix='panel-poll')
+
+def poll_panel(api):
+    # Provisional; check_and_update reschedules from the outcome
+    api.next_poll = time.monotonic() + api.scheduler.interval
+    api.last_fetch_ok = False
+    if not api.logged_in:
+        add_debug("⚠️ %s: not logged in, logging in...", api.name, level=logging.WARNING)
+        if not api.ensure_login():
+            add_debug("❌ %s: login failed", api.name, level=logging.ERROR)
+            POLLS.inc(api.name, 'error')
+            return []
+    messages = api.fetch_messages()
+    POLLS.inc(api.name, 'ok' if api.last_fetch_ok else 'error')
+    api.last_poll = datetime.now().strftime('%H:%M:%S')
+    api.last_fetched = len(messages)
+    return messages
+
+def summarize_panels():
+    bot_stats['panels'] = {
+        api.name: {
+            'status': api.status,
+            'last_poll': api.last_poll,
+            'last_fetched': api.last_fetched,
+            'last_error': api.last_error,
+            'circuit': api.breaker.state,
+            'timing': api.transport.stats(),
+        }
+        for api in scrapers
+    }
+    bot_stats['scheduler'] = {
+        'next_poll_in': round(seconds_until_next_poll(), 1),
+        'panels': {api.name: api.scheduler.stats() for api in scrapers},
+    }
+    if len(scrapers) == 1:
+        bot_stats['scraper_status'] = scrapers[0].status
+    else:
+        connected = sum(api.logged_in for api in scrapers)
+        bot_stats['scraper_status'] = f"{'✅' if connected == len(scrapers) else '⚠️'} {connected}/{len(scrapers)} panels connected"
+
+def seconds_until_next_poll():
+    if not scrapers:
+        return POLL_INTERVAL
+    return max(0.5, min(api.next_poll for api in scrapers) - time.monotonic())
+
+class SingleFlight:
+    # Callers that arrive while a call is in flight wait for it and get its
+    # result instead of starting their own.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None
+        self.started = 0
+        self.joined = 0
+    
+    def do(self, fn, *args, **kwargs):
+        with self.lock:
+            call = self.current
+            if call is None:
+                call = self.current = {'done': threading.Event(), 'result': None, 'error': None}
+                self.started += 1
+                leader = True
+            else:
+                self.joined += 1
+                leader = False
         
-        messages = scraper.fetch_messages()
-        bot_stats['last_check'] = datetime.now().strftime('%H:%M:%S')
-        
-        add_debug(f"📨 Fetched {len(messages)} messages")
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
         
-        new_count = 0
-        for msg in messages:
-            if otp_filter.is_new(msg['id']):
-                all_messages.insert(0, msg)
-                bot_stats['total_otps'] += 1
-                new_count += 1
+        try:
+            call['result'] = fn(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                self.current = None
+            call['done'].set()
+    
+    def stats(self):
+        return {'started': self.started, 'joined': self.joined}
+
+poll_flight = SingleFlight()
+
+def check_and_update(force=False):
+    # A manual refresh that arrives during a poll joins it rather than hitting
+    # the panel again
+    return poll_flight.do(_check_and_update, force)
+
+def _check_and_update(force=False):
+    global scrapers
+    
+    try:
+        add_debug("🔄 Starting check...", level=logging.DEBUG)
         
-        add_debug(f"🆕 New messages: {new_count}")
+        if not scrapers:
+            add_debug("⚠️ No scrapers, creating...", level=logging.WARNING)
+            scrapers = create_scrapers()
+            if not scrapers:
+                add_debug("❌ Failed to create scrapers", level=logging.ERROR)
+                return
         
-        all_messages = all_messages[:MAX_MESSAGES]
+        # Panels are polled concurrently, each on its own schedule, so one slow
+        # panel only delays itself
+        now = time.monotonic()
+        due = [api for api in scrapers if force or api.next_poll <= now]
+        if len(due) == 1:
+            batches = [poll_panel(due[0])]
+        else:
+            batches = list(poll_executor.map(poll_panel, due))
+        return len(ingest(due, [msg for batch in batches for msg in batch]))
                 
     except Exception as e:
-        add_debug(f"❌ Check error: {str(e)}")
+        add_debug("❌ Check error: %s", str(e), level=logging.ERROR)
+        ERRORS.inc('check', type(e).__name__)
         bot_stats['last_error'] = str(e)
+    finally:
+        if shared_state and shared_state.is_poller:
+            shared_state.publish()
+
+def ingest(due, messages):
+    # Everything after the panels answered: dedup, store, fan-out, reschedule.
+    # Returns the messages that were new.
+    bot_stats['last_check'] = datetime.now().strftime('%H:%M:%S')
+    
+    add_debug("📨 Fetched %s messages", len(messages), level=logging.DEBUG)
+    
+    # Ids are keyed as strings, the form history stores them in
+    new_messages = [msg for msg in messages if otp_filter.is_new(str(msg['id']))]
+    received_at = time.time()
+    for msg in new_messages:
+        msg['received_at'] = received_at
+    message_store.add_many(new_messages)
+    otp_waiters.notify(new_messages)
+    for listener in message_listeners:
+        listener(new_messages)
+    webhooks.publish(new_messages)
+    if message_history:
+        try:
+            message_history.add_many(new_messages)
+        except Exception as e:
+            add_debug("❌ History write error: %s", str(e), level=logging.ERROR)
+            ERRORS.inc('history', type(e).__name__)
+    new_count = len(new_messages)
+    bot_stats['total_otps'] += new_count
+    MESSAGES.inc('new', amount=new_count)
+    MESSAGES.inc('duplicate', amount=len(messages) - new_count)
+    
+    new_by_source = Counter(msg['source'] for msg in new_messages)
+    waiting = any(otp_wait_pools)
+    for api in due:
+        api.next_poll = time.monotonic() + api.scheduler.record(new_by_source[api.name], api.last_fetch_ok, waiting)
+    summarize_panels()
+    
+    if new_messages:
+        live_events.publish('messages', new_messages)
+    message_store.bump(visible_stats())
+    publish_stats()
+    
+    add_debug("🆕 New messages: %s", new_count)
+    return new_messages
+
+def clear_state():
+    otp_filter.clear()
+    bot_stats['total_otps'] = 0
+    message_store.clear()
+    live_events.publish('clear', {})
+    add_debug("🗑️ Cache cleared")
+    if shared_state and shared_state.is_poller:
+        shared_state.publish()
+
+# Set to cut the current wait short and poll right away
+poll_wakeup = threading.Event()
+
+def seed_dedup_from_history():
+    # Messages recorded by a previous run are not new again after a restart
+    if not message_history:
+        return
+    try:
+        seen = message_history.recent_ids(DEDUP_MAX_SIZE or MAX_MESSAGES)
+        for msg_id in seen:
+            otp_filter.is_new(msg_id)
+        add_debug("🧠 Dedup seeded with %s ids from history", len(seen))
+    except Exception as e:
+        add_debug("❌ History read error: %s", str(e), level=logging.ERROR)
 
 def background_monitor():
     bot_stats['is_running'] = True
     add_debug("🚀 Background monitor started")
+    seed_dedup_from_history()
     
     # First check immediately
     check_and_update()
     
     while bot_stats['is_running']:
         try:
-            time.sleep(10)
-            check_and_update()
+            forced = poll_wakeup.wait(seconds_until_next_poll())
+            poll_wakeup.clear()
+            check_and_update(force=forced)
         except Exception as e:
-            add_debug(f"❌ Monitor error: {str(e)}")
+            add_debug("❌ Monitor error: %s", str(e), level=logging.ERROR)
             time.sleep(30)
 
+def start_background_monitor():
+    if shared_state:
+        shared_state.start()
+    else:
+        threading.Thread(target=background_monitor, daemon=True).start()
+
+#============================================
+# Shared State (multi-worker)
+#============================================
+
+class SharedState:
+    # Every worker runs two daemon threads: one blocks on an exclusive flock of
+    # poller.lock and becomes the poller once it gets it (so a replacement is
+    # elected as soon as the current poller exits); the other reloads state.json
+    # whenever the poller has replaced it. Workers that are not the poller send
+    # refresh/clear requests as files in commands/.
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, 'state.json')
+        self.lock_path = os.path.join(directory, 'poller.lock')
+        self.commands_dir = os.path.join(directory, 'commands')
+        self.is_poller = False
+        self.lock_file = None
+        self.loaded = None
+        self.sync_lock = threading.Lock()
+        # The poll thread and clear_state() (command watcher or a request
+        # thread) both publish; they share one tmp file and must not interleave
+        self.publish_lock = threading.Lock()
+    
+    def start(self):
+        os.makedirs(self.commands_dir, exist_ok=True)
+        threading.Thread(target=self._follow, daemon=True).start()
+        threading.Thread(target=self._elect, daemon=True).start()
+    
+    def _elect(self):
+        import fcntl
+        self.lock_file = open(self.lock_path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        
+        # Carry on from what the previous poller published
+        self.sync()
+        for msg in message_store.snapshot():
+            otp_filter.is_new(str(msg['id']))
+        self.is_poller = True
+        add_debug("👑 Worker %s elected as poller", os.getpid())
+        
+        threading.Thread(target=self._watch_commands, daemon=True).start()
+        background_monitor()
+    
+    def _follow(self):
+        while not self.is_poller:
+            try:
+                self.sync()
+            except Exception as e:
+                add_debug("❌ Shared state sync error: %s", str(e), level=logging.ERROR)
+            time.sleep(SHARED_SYNC_INTERVAL)
+    
+    def sync(self):
+        with self.sync_lock:
+            try:
+                st = os.stat(self.state_path)
+            except FileNotFoundError:
+                return False
+            key = (st.st_ino, st.st_mtime_ns)
+            if key == self.loaded:
+                return False
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.loaded = key
+        
+        previous = message_store.version
+        message_store.load(state['store'])
+        bot_stats.update(state['stats'])
+        metrics.load(state.get('metrics', {}))
+        debug_events.clear()
+        debug_events.extend(DebugRecord(logging.INFO, line, (), line) for line in state['debug'])
+        
+        # Replay the change to this worker's live viewers
+        _, newer, full = message_store.since(previous)
+        if full:
+            live_events.publish('clear', {})
+        elif newer:
+            otp_waiters.notify(newer)
+            live_events.publish('messages', newer[::-1])
+        publish_stats()
+        return True
+    
+    def wait_for_update(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.sync():
+                return True
+            time.sleep(0.2)
+        return False
+    
+    def publish(self):
+        with self.publish_lock:
+            state = {
+                'store': message_store.export(),
+                'stats': bot_stats,
+                'debug': debug_log_lines(),
+                'metrics': metrics.export(),
+            }
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.state_path)
+    
+    def request(self, command):
+        path = os.path.join(self.commands_dir, f"{command}.{os.getpid()}.{time.time_ns()}")
+        open(path, 'w').close()
+    
+    def _watch_commands(self):
+        while True:
+            try:
+                for name in sorted(os.listdir(self.commands_dir)):
+                    try:
+                        os.remove(os.path.join(self.commands_dir, name))
+                    except FileNotFoundError:
+                        continue
+                    command = name.split('.', 1)[0]
+                    if command == 'clear':
+                        clear_state()
+                    elif command == 'refresh':
+                        poll_wakeup.set()
+            except Exception as e:
+                add_debug("❌ Command watcher error: %s", str(e), level=logging.ERROR)
+            time.sleep(0.5)
+
+shared_state = SharedState(SHARED_STATE_DIR) if SHARED_STATE_DIR else None
+
+#============================================
+# Refresh Jobs
+#============================================
+
+def run_refresh():
+    if shared_state and not shared_state.is_poller:
+        shared_state.request('refresh')
+        shared_state.wait_for_update(PANEL_CONNECT_TIMEOUT + PANEL_READ_TIMEOUT)
+        return None
+    return check_and_update(force=True)
+
+
+class RefreshJobs:
+    # Manual refreshes return a job id right away and run on a background
+    # thread, so a slow panel never holds a web worker. While a refresh is
+    # running, further requests get the same job.
+    def __init__(self, kept):
+        self.kept = kept
+        self.jobs = OrderedDict()
+        self.running = None
+        self.lock = threading.Lock()
+    
+    def submit(self, start=None):
+        # `start(job)` launches the refresh (and must end it with finish());
+        # by default it runs run_refresh() on a new thread
+        with self.lock:
+            if self.running is not None:
+                return self.running
+            job = {
+                'id': os.urandom(6).hex(),
+                'status': 'running',
+                'started': datetime.now().strftime('%H:%M:%S'),
+                'finished': None,
+                'new_messages': None,
+                'error': None,
+            }
+            self.jobs[job['id']] = job
+            while len(self.jobs) > self.kept:
+                self.jobs.popitem(last=False)
+            self.running = job
+        if start:
+            start(job)
+        else:
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+    
+    def _run(self, job):
+        try:
+            self.finish(job, run_refresh())
+        except Exception as e:
+            self.finish(job, error=e)
+    
+    def finish(self, job, new_messages=None, error=None):
+        if error is None:
+            job['new_messages'] = new_messages
+            job['status'] = 'done'
+        else:
+            job['status'] = 'failed'
+            job['error'] = str(error)
+        job['finished'] = datetime.now().strftime('%H:%M:%S')
+        with self.lock:
+            self.running = None
+        live_events.publish('job', job)
+    
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+refresh_jobs = RefreshJobs(REFRESH_JOBS_KEPT)
+
 #============================================
 # HTML Template
 #============================================
@@ -641,15 +2766,15 @@ HTML_TEMPLATE = '''
             
             <div class="stats-bar">
                 <div class="stat-item">
-                    <div class="stat-value">{{ stats.total_otps }}</div>
+                    <div class="stat-value" id="statTotal">{{ stats.total_otps }}</div>
                     <div class="stat-label">Total OTPs</div>
                 </div>
                 <div class="stat-item">
-                    <div class="stat-value">{{ stats.last_check }}</div>
+                    <div class="stat-value" id="statLastCheck">{{ stats.last_check }}</div>
                     <div class="stat-label">Last Check</div>
                 </div>
                 <div class="stat-item">
-                    <div class="stat-value">{{ messages|length }}</div>
+                    <div class="stat-value" id="statCount">{{ messages|length }}</div>
                     <div class="stat-label">Messages</div>
                 </div>
             </div>
@@ -677,6 +2802,11 @@ HTML_TEMPLATE = '''
         <div id="debugPanel" class="debug-panel" style="display:none;">
             <h3>🔧 Debug Logs</h3>
             <p><strong>Status:</strong> {{ stats.scraper_status }}</p>
+            {% if stats.panels|length > 1 %}
+            {% for name, panel in stats.panels.items() %}
+            <p>&nbsp;&nbsp;• {{ name }}: {{ panel.status }} (last poll {{ panel.last_poll or 'never' }}, {{ panel.last_fetched }} fetched)</p>
+            {% endfor %}
+            {% endif %}
             <p><strong>Last Error:</strong> {{ stats.last_error or 'None' }}</p>
             <hr style="margin: 10px 0; border-color: rgba(255,255,255,0.1);">
             <h4>API Response:</h4>
@@ -729,7 +2859,7 @@ HTML_TEMPLATE = '''
     
     <div class="refresh-indicator">
         <span class="pulse"></span>
-        Auto-refresh: <span id="countdown">10</span>s
+        <span id="liveStatus">Connecting...</span>
     </div>
 
     <script>
@@ -740,7 +2870,15 @@ HTML_TEMPLATE = '''
         }
         
         function manualCheck() {
-            fetch('/api/refresh').then(() => location.reload());
+            // New messages arrive over the stream; without it, wait for the job
+            fetch('/api/refresh').then(r => r.json()).then(job => {
+                if (liveStream) return;
+                const poll = () => fetch(job.url).then(r => r.json()).then(j => {
+                    if (j.status === 'running') setTimeout(poll, 1000);
+                    else location.reload();
+                });
+                poll();
+            });
         }
         
         function clearAll() {
@@ -767,77 +2905,325 @@ HTML_TEMPLATE = '''
             }
         }
         
-        // Auto-refresh
-        let countdown = 10;
-        setInterval(() => {
-            countdown--;
-            document.getElementById('countdown').textContent = countdown;
-            if (countdown <= 0) {
-                location.reload();
-            }
-        }, 1000);
+        // Live updates: the server pushes only new messages over /api/stream
+        const MAX_MESSAGES = {{ max_messages }};
+        let liveStream = null;
+        
+        function renderCard(msg) {
+            const card = document.createElement('div');
+            card.className = 'message-card';
+            card.innerHTML = `
+                <div class="card-header">
+                    <div class="country-info">
+                        <span class="country-flag"></span>
+                        <span class="country-name"></span>
+                    </div>
+                    <span class="service-badge"></span>
+                </div>
+                <div class="otp-section">
+                    <div style="font-size:12px; color:#888;">OTP CODE</div>
+                    <div class="otp-code"></div>
+                    <button class="copy-btn">📋 Copy</button>
+                </div>
+                <div class="info-row">
+                    <span class="info-label">📱 Phone</span>
+                    <span class="info-value"></span>
+                </div>
+                <div class="message-content"></div>
+                <div class="timestamp"></div>`;
+            card.querySelector('.country-flag').textContent = msg.country_flag;
+            card.querySelector('.country-name').textContent = msg.country || 'Unknown';
+            card.querySelector('.service-badge').textContent = msg.service;
+            card.querySelector('.otp-code').textContent = msg.otp;
+            card.querySelector('.info-value').textContent = msg.phone_masked;
+            card.querySelector('.message-content').textContent = msg.raw_message;
+            card.querySelector('.timestamp').textContent = '⏰ ' + msg.timestamp;
+            card.querySelector('.copy-btn').onclick = function() { copyOTP(this, msg.otp); };
+            return card;
+        }
+        
+        function addMessages(messages) {
+            const grid = document.getElementById('messagesPanel');
+            const empty = grid.querySelector('.empty-state');
+            if (empty) empty.remove();
+            messages.forEach(msg => grid.prepend(renderCard(msg)));
+            while (grid.children.length > MAX_MESSAGES) grid.lastElementChild.remove();
+        }
+        
+        function updateStats(stats) {
+            document.getElementById('statTotal').textContent = stats.total_otps;
+            document.getElementById('statLastCheck').textContent = stats.last_check;
+            document.getElementById('statCount').textContent = stats.count;
+        }
+        
+        if (window.EventSource) {
+            let dropped = false;
+            liveStream = new EventSource('/api/stream');
+            liveStream.addEventListener('messages', e => addMessages(JSON.parse(e.data)));
+            liveStream.addEventListener('stats', e => updateStats(JSON.parse(e.data)));
+            liveStream.addEventListener('clear', () => location.reload());
+            liveStream.onopen = () => {
+                // Anything pushed while we were disconnected is lost, resync once
+                if (dropped) location.reload();
+                document.getElementById('liveStatus').textContent = 'Live';
+            };
+            liveStream.onerror = () => {
+                dropped = true;
+                document.getElementById('liveStatus').textContent = 'Reconnecting...';
+            };
+        } else {
+            let countdown = 10;
+            setInterval(() => {
+                countdown--;
+                document.getElementById('liveStatus').textContent = `Auto-refresh: ${countdown}s`;
+                if (countdown <= 0) {
+                    location.reload();
+                }
+            }, 1000);
+        }
     </script>
 </body>
 </html>
 '''
 
+#============================================
+# Read Snapshots
+#============================================
+
+class SnapshotCache:
+    # Caches the rendered body of each read endpoint together with the store
+    # version it was built from. check_and_update and /api/clear move the version,
+    # so everything in between is served from the same bytes. Debug lines shown
+    # alongside are therefore as of the last state change.
+    def __init__(self):
+        self.entries = {}  # name -> (version, body, gzipped body or None)
+        self.lock = threading.Lock()
+    
+    def get(self, name, build):
+        # build(version, messages) gets the store as of one version, and the
+        # entry is keyed on that version
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != message_store.version:
+            with self.lock:
+                version, messages = message_store.versioned_snapshot()
+                entry = self.entries.get(name)
+                if entry is None or entry[0] != version:
+                    with RENDER_SECONDS.time(name):
+                        body = build(version, messages)
+                    gzipped = None
+                    if SNAPSHOT_GZIP and len(body) >= SNAPSHOT_GZIP_MIN:
+                        gzipped = gzip.compress(body, compresslevel=6)
+                    entry = (version, body, gzipped)
+                    self.entries[name] = entry
+        return entry
+
+snapshots = SnapshotCache()
+dashboard_template = app.jinja_env.from_string(HTML_TEMPLATE)
+
+
+def snapshot_response(name, build, mimetype):
+    version, body, gzipped = snapshots.get(name, build)
+    etag = message_store.cursor(version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    headers = {'Vary': 'Accept-Encoding'}
+    if gzipped is not None and request.accept_encodings['gzip']:
+        body = gzipped
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(body, mimetype=mimetype, headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+def render_dashboard(version, messages):
+    return dashboard_template.render(
+        messages=messages,
+        stats=bot_stats,
+        debug_logs=debug_log_lines(),
+        max_messages=MAX_MESSAGES
+    ).encode('utf-8')
+
+
+def dump_json(payload):
+    return app.json.dumps(payload).encode('utf-8')
+
 #============================================
 # Flask Routes
 #============================================
 
 @app.route('/')
 def home():
-    return render_template_string(HTML_TEMPLATE, 
-                                  messages=all_messages, 
-                                  stats=bot_stats,
-                                  debug_logs=debug_logs)
+    return snapshot_response('home', render_dashboard, 'text/html')
+
+QUERY_PARAMS = frozenset(('service', 'country', 'phone', 'has_otp', 'start', 'end', 'limit', 'before', 'fields'))
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def query_messages(since):
+    # /api/messages with any of QUERY_PARAMS: matching messages only, newest
+    # first, `limit` per page with `next` as the following page's `before`.
+    # `phone` is a prefix, `start`/`end` a ts window, `since` a store version.
+    args = request.args
+    filters = {field: args[field] for field in ('service', 'country', 'phone') if field in args}
+    if 'has_otp' in args:
+        filters['has_otp'] = args['has_otp'].lower() in TRUE_VALUES
+    limit = min(max(args.get('limit', 50, type=int), 1), MAX_MESSAGES)
+    # Read before the query: a version older than the results only repeats a
+    # message on the next ?since=, a newer one would skip it
+    version = message_store.version
+    messages, cursor = message_store.query(
+        filters,
+        start=args.get('start', type=float),
+        end=args.get('end', type=float),
+        after=since,
+        before=args.get('before', type=int),
+        limit=limit
+    )
+    fields = [f for f in args.get('fields', '').split(',') if f]
+    if fields:
+        messages = [{f: msg[f] for f in fields if f in msg} for msg in messages]
+    response = jsonify({'messages': messages, 'next': cursor, 'version': message_store.cursor(version)})
+    response.set_etag(message_store.cursor(version))
+    return response
 
 @app.route('/api/messages')
 def api_messages():
-    return jsonify({
-        'messages': all_messages,
+    # Clients send back the ETag (or the 'version' field as ?since=) they were
+    # given; an unchanged store answers 304 without serialising anything.
+    etag = message_store.cursor()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    since = message_store.parse_cursor(request.args.get('since'))
+    if not QUERY_PARAMS.isdisjoint(request.args):
+        return query_messages(since)
+    if since is None:
+        return snapshot_response('messages', lambda version, messages: dump_json({
+            'messages': messages,
+            'version': message_store.cursor(version),
+            'full': True,
+            'stats': bot_stats,
+            'debug': debug_log_lines(10)
+        }), 'application/json')
+    
+    version, messages, full = message_store.since(since)
+    response = jsonify({
+        'messages': messages,
+        'version': message_store.cursor(version),
+        'full': full,
         'stats': bot_stats,
-        'debug': debug_logs[:10]
+        'debug': debug_log_lines(10)
+    })
+    response.set_etag(message_store.cursor(version))
+    return response
+
+@app.route('/api/history')
+def api_history():
+    if not message_history:
+        return jsonify({'status': 'error', 'error': 'History is disabled (set HISTORY_DB)'}), 404
+    limit = min(request.args.get('limit', 50, type=int), HISTORY_PAGE_MAX)
+    try:
+        messages, cursor = message_history.page(request.args, request.args.get('before'), max(limit, 1))
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'Invalid cursor'}), 400
+    return jsonify({'messages': messages, 'next': cursor})
+
+@app.route('/api/otp/<phone>')
+def api_otp(phone):
+    # Newest stored message for the number received after `since` (unix time on
+    # this server's clock; default: any), or the first one to arrive within
+    # `wait` seconds
+    wait = min(max(request.args.get('wait', 0, type=float), 0), OTP_WAIT_MAX)
+    since = request.args.get('since', 0, type=float)
+    msg = otp_waiters.wait(phone, since, wait)
+    if msg is None:
+        return jsonify({'status': 'timeout', 'phone': phone}), 404
+    return jsonify({'status': 'ok', 'otp': msg['otp'], 'message': msg})
+
+@app.route('/api/stream')
+def api_stream():
+    return Response(live_events.stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     })
 
 @app.route('/api/refresh')
 def api_refresh():
     add_debug("⚡ Manual refresh triggered")
-    check_and_update()
-    return jsonify({'status': 'ok', 'count': len(all_messages)})
+    job = refresh_jobs.submit()
+    return jsonify({
+        'status': 'accepted',
+        'job': job['id'],
+        'url': f"/api/jobs/{job['id']}",
+        'count': len(message_store)
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = refresh_jobs.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': 'Unknown job'}), 404
+    return jsonify({**job, 'count': len(message_store)})
 
 @app.route('/api/clear')
 def api_clear():
-    global all_messages
-    all_messages = []
-    otp_filter.clear()
-    bot_stats['total_otps'] = 0
-    add_debug("🗑️ Cache cleared")
+    if shared_state and not shared_state.is_poller:
+        shared_state.request('clear')
+        shared_state.wait_for_update(5)
+    else:
+        clear_state()
     return jsonify({'status': 'ok'})
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # The rule, not the path, so /api/jobs/<job_id> stays a single series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - start, route, request.method)
+    return response
+
+@app.route('/metrics')
+def api_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/debug')
 def api_debug():
-    return jsonify({
+    # Not cached or tagged with the store version: most of it (schedule, polls,
+    # timings, logs) changes on polls that leave the store alone
+    return Response(dump_json({
         'stats': bot_stats,
-        'logs': debug_logs,
-        'messages_count': len(all_messages)
-    })
+        'logs': debug_log_lines(),
+        'messages_count': len(message_store),
+        'dedup': otp_filter.stats(),
+        'polls': poll_flight.stats(),
+        'webhooks': webhooks.stats()
+    }), mimetype='application/json', headers={'Cache-Control': 'no-store'})
 
 #============================================
 # Main
 #============================================
 
 def main():
-    global scraper
+    global scrapers
     
     add_debug("🚀 Starting SMS OTP Dashboard...")
     
-    scraper = create_scraper()
+    if not shared_state:
+        scrapers = create_scrapers()
     
-    threading.Thread(target=background_monitor, daemon=True).start()
+    start_background_monitor()
     
     port = int(os.environ.get('PORT', 5000))
-    add_debug(f"🌐 Dashboard at http://localhost:{port}")
+    add_debug("🌐 Dashboard at http://localhost:%s", port)
     
     app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
 
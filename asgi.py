@@ -0,0 +1,596 @@
+import asyncio
+import io
+import logging
+import os
+import random
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote
+
+import httpx
+
+import app as core
+from app import add_debug
+
+# asyncio runtime: one process, one event loop. The panels are polled by a task
+# through httpx.AsyncClient, and /api/stream, /api/otp/<phone> and /api/refresh
+# are served natively, so an idle viewer or waiter is a parked coroutine rather
+# than a thread. The remaining routes are plain Flask views and run through a
+# small WSGI bridge on ASGI_WSGI_THREADS threads.
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#
+# Needs httpx and an ASGI server (uvicorn); multi-worker shared state does not
+# apply here.
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 8))
+
+#============================================
+# Async Panel Client
+#============================================
+
+# Same policy as app.build_retry(): statuses retried for GETs, connection errors
+# for any method, Retry-After honoured on 503 up to PANEL_RETRY_AFTER_MAX
+RETRY_STATUSES = (502, 503, 504)
+RETRY_AFTER_STATUSES = (503,)
+RETRY_BACKOFF_MAX = 120
+
+
+def retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value or response.status_code not in RETRY_AFTER_STATUSES:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), core.PANEL_RETRY_AFTER_MAX)
+
+
+def retry_backoff(attempt):
+    # urllib3's formula: the first retry goes straight away
+    if attempt <= 1:
+        return 0.0
+    delay = core.PANEL_RETRY_BACKOFF * 2 ** (attempt - 1) + random.random() * core.PANEL_RETRY_JITTER
+    return min(RETRY_BACKOFF_MAX, delay)
+
+
+class AsyncPanelTransport:
+    # app.PanelTransport over the shared httpx.AsyncClient: the panel session's
+    # headers, the same retries, and timing samples written to the panel's own
+    # PanelTransport so bot_stats and /api/debug read them as before.
+    def __init__(self, api, client):
+        self.client = client
+        self.timings = api.transport.timings
+        # The token is sent per request, with whatever the panel API holds now
+        self.headers = {name: value for name, value in api.session.headers.items()
+                        if name.lower() != 'authorization'}
+    
+    async def request(self, method, url, headers=None, **kwargs):
+        headers = {**self.headers, **(headers or {})}
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(method, url, headers, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.ReadTimeout) as e:
+                connect_error = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt >= core.PANEL_RETRIES or not (connect_error or method == 'GET'):
+                    raise
+                delay = None
+            else:
+                if method != 'GET' or response.status_code not in RETRY_STATUSES or attempt >= core.PANEL_RETRIES:
+                    return response
+                delay = retry_after(response)
+            attempt += 1
+            await asyncio.sleep(retry_backoff(attempt) if delay is None else delay)
+    
+    async def _send(self, method, url, headers, **kwargs):
+        connect = {'started': None, 'seconds': 0.0}
+        
+        async def trace(event, info):
+            # Stays 0 when a pooled keep-alive connection was reused
+            if event == 'connection.connect_tcp.started':
+                connect['started'] = time.perf_counter()
+            elif event in ('connection.connect_tcp.complete', 'connection.start_tls.complete') and connect['started']:
+                connect['seconds'] = time.perf_counter() - connect['started']
+        
+        request = self.client.build_request(method, url, headers=headers, extensions={'trace': trace}, **kwargs)
+        start = time.perf_counter()
+        response = await self.client.send(request, stream=True)
+        first_byte = time.perf_counter()
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        done = time.perf_counter()
+        
+        seconds = connect['seconds']
+        self.timings.append({
+            'method': method,
+            'status': response.status_code,
+            'connect_ms': round(seconds * 1000, 1),
+            'ttfb_ms': round((first_byte - start - seconds) * 1000, 1),
+            'download_ms': round((done - first_byte) * 1000, 1),
+            'bytes': len(body),
+            'reused': seconds == 0,
+        })
+        return response
+
+
+class AsyncPanelClient:
+    # The HTTP half of a PanelAPI on the event loop. Login state, cursor, breaker,
+    # scheduler and response parsing all stay on the wrapped PanelAPI.
+    def __init__(self, api, client):
+        self.api = api
+        self.transport = AsyncPanelTransport(api, client)
+        self.login_lock = asyncio.Lock()
+
+    async def _request(self, method, url, **kwargs):
+        api = self.api
+        if not api.breaker.allow():
+            raise core.CircuitOpenError(f"circuit open for {api.name}, retrying in up to {api.breaker.reset_timeout:.0f}s")
+        try:
+            response = await self.transport.request(method, url, **kwargs)
+        except Exception:
+            # As in PanelAPI._request: anything else would leave a probe hanging
+            api.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            api.breaker.record_failure()
+        else:
+            api.breaker.record_success()
+        return response
+
+    async def login(self):
+        api = self.api
+        try:
+            add_debug("🔐 Attempting login to %s", api.base_url)
+            with core.LOGIN_SECONDS.time(api.name):
+                response = await self._request(
+                    'POST',
+                    f"{api.base_url}/api/auth/login",
+                    json={"username": api.username, "password": api.password}
+                )
+            return api._handle_login(response)
+        except Exception as e:
+            return api._login_error(e)
+
+    async def ensure_login(self, stale_token=None):
+        api = self.api
+        async with self.login_lock:
+            if api.logged_in and (stale_token is None or api.token != stale_token):
+                return True
+            api.logged_in = False
+            return await self.login()
+
+    async def fetch_messages(self):
+        api = self.api
+        api.last_fetch_ok = False
+        if not api.logged_in:
+            add_debug("⚠️ Not logged in, attempting login...", level=logging.WARNING)
+            if not await self.ensure_login():
+                return []
+
+        try:
+            url, params = api._page_request()
+            token = api.token
+            with core.FETCH_SECONDS.time(api.name):
+                response = await self._request('GET', url, params=params, headers={'Authorization': f'Bearer {token}'})
+            add_debug("📥 Response status: %s", response.status_code, level=logging.DEBUG)
+
+            if response.status_code == 401:
+                add_debug("⚠️ Token expired, re-logging in...", level=logging.WARNING)
+                core.RELOGINS.inc(api.name)
+                if not await self.ensure_login(stale_token=token):
+                    return []
+                with core.FETCH_SECONDS.time(api.name):
+                    response = await self._request('GET', url, params=params, headers={'Authorization': f'Bearer {api.token}'})
+
+            if response.status_code != 200:
+                add_debug("❌ Failed to fetch: %s", response.status_code, level=logging.ERROR)
+                if core.DEBUG_CAPTURE_PAYLOADS:
+                    add_debug("Response: %s", response.text[:300], level=logging.ERROR)
+                return []
+
+            return api._read_page(response)
+
+        except Exception as e:
+            return api._fetch_error(e)
+
+    async def poll(self):
+        # Same steps as app.poll_panel
+        api = self.api
+        api.next_poll = time.monotonic() + api.scheduler.interval
+        api.last_fetch_ok = False
+        if not api.logged_in:
+            add_debug("⚠️ %s: not logged in, logging in...", api.name, level=logging.WARNING)
+            if not await self.ensure_login():
+                add_debug("❌ %s: login failed", api.name, level=logging.ERROR)
+                core.POLLS.inc(api.name, 'error')
+                return []
+        messages = await self.fetch_messages()
+        core.POLLS.inc(api.name, 'ok' if api.last_fetch_ok else 'error')
+        api.last_poll = core.datetime.now().strftime('%H:%M:%S')
+        api.last_fetched = len(messages)
+        return messages
+
+#============================================
+# Live Events and Waiters (asyncio)
+#============================================
+
+class AsyncEvents:
+    # Joins app.live_events as one more subscriber "queue": each event is still
+    # serialised once there, then fanned out on the loop to every open stream.
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscribers = set()
+
+    def put_nowait(self, payload):
+        # Called from whichever thread published the event
+        self.loop.call_soon_threadsafe(self._fan_out, payload)
+
+    def _fan_out(self, payload):
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(payload)
+            except asyncio.QueueFull:
+                # Too slow: disconnect it, the page reloads when it reconnects
+                self.subscribers.discard(q)
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+
+
+class AsyncOTPWaiters:
+    # app.OTPWaiters with futures instead of Events: a waiter is a future in a
+    # list keyed by phone, resolved on the loop when its number gets a message.
+    def __init__(self, loop):
+        self.loop = loop
+        self.waiting = {}  # phone key -> list of [future, since]
+        self.hurried = float('-inf')
+
+    def notify_threadsafe(self, messages):
+        if self.waiting and messages:
+            self.loop.call_soon_threadsafe(self.notify, messages)
+
+    def notify(self, messages):
+        for msg in messages:
+            for future, since in self.waiting.get(core.phone_key(msg.get('phone')), ()):
+                if not future.done() and msg['received_at'] > since:
+                    future.set_result(msg)
+
+    async def wait(self, phone, since, timeout):
+        # Registered before the store is checked, as in app.OTPWaiters
+        key = core.phone_key(phone)
+        waiter = [self.loop.create_future(), since]
+        self.waiting.setdefault(key, []).append(waiter)
+        try:
+            msg = core.message_store.latest('phone', phone, since)
+            if msg is not None:
+                return msg
+            self.hurry()
+            return await asyncio.wait_for(waiter[0], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self.waiting.get(key)
+            if waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.waiting[key]
+
+    def hurry(self):
+        # As app.hurry_poll: poll now for a new waiter; ingest() then holds the
+        # panels at POLL_MIN_INTERVAL while any waiter is parked here
+        now = time.monotonic()
+        if now - self.hurried >= core.POLL_MIN_INTERVAL:
+            self.hurried = now
+            runtime.wakeup.set()
+
+    def __len__(self):
+        # Read from other threads (metrics), so iterate over a copy
+        return sum(len(waiters) for waiters in list(self.waiting.values()))
+
+    def __bool__(self):
+        return bool(self.waiting)
+
+#============================================
+# Poll Loop
+#============================================
+
+class Runtime:
+    def __init__(self):
+        self.clients = []
+        self.http = None
+        self.events = None
+        self.waiters = None
+        self.wakeup = None
+        self.current = None
+        self.poller = None
+        self.wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='wsgi')
+
+runtime = Runtime()
+
+
+async def check_and_update(force=False):
+    # Single flight, like app.check_and_update: callers arriving during a poll
+    # share its result
+    if runtime.current is None:
+        runtime.current = asyncio.ensure_future(_check_and_update(force))
+        runtime.current.add_done_callback(lambda _: setattr(runtime, 'current', None))
+    return await asyncio.shield(runtime.current)
+
+
+async def _check_and_update(force=False):
+    try:
+        add_debug("🔄 Starting check...", level=logging.DEBUG)
+        now = time.monotonic()
+        due = [client for client in runtime.clients if force or client.api.next_poll <= now]
+        batches = await asyncio.gather(*(client.poll() for client in due))
+        messages = [msg for batch in batches for msg in batch]
+        # Dedup, store and history writes take locks and touch SQLite: off the loop
+        new_messages = await asyncio.to_thread(core.ingest, [client.api for client in due], messages)
+        return len(new_messages)
+    except Exception as e:
+        add_debug("❌ Check error: %s", str(e), level=logging.ERROR)
+        core.ERRORS.inc('check', type(e).__name__)
+        core.bot_stats['last_error'] = str(e)
+
+
+async def poll_loop():
+    core.bot_stats['is_running'] = True
+    add_debug("🚀 Async monitor started")
+    await asyncio.to_thread(core.seed_dedup_from_history)
+    await check_and_update()
+    while True:
+        try:
+            try:
+                await asyncio.wait_for(runtime.wakeup.wait(), core.seconds_until_next_poll())
+                forced = True
+            except asyncio.TimeoutError:
+                forced = False
+            runtime.wakeup.clear()
+            await check_and_update(force=forced)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            add_debug("❌ Monitor error: %s", str(e), level=logging.ERROR)
+            await asyncio.sleep(30)
+
+
+async def startup():
+    loop = asyncio.get_running_loop()
+    if core.shared_state:
+        add_debug("⚠️ SHARED_STATE_DIR is ignored by the asyncio runtime (single process)", level=logging.WARNING)
+        core.shared_state = None
+
+    runtime.events = AsyncEvents(loop)
+    with core.live_events.lock:
+        core.live_events.subscribers.add(runtime.events)
+    runtime.waiters = AsyncOTPWaiters(loop)
+    core.message_listeners.append(runtime.waiters.notify_threadsafe)
+    core.otp_wait_pools.append(runtime.waiters)
+    runtime.wakeup = asyncio.Event()
+
+    core.scrapers = core.create_scrapers() or []
+    pool = max(core.PANEL_POOL_SIZE * len(core.scrapers), 1)
+    runtime.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(core.PANEL_READ_TIMEOUT, connect=core.PANEL_CONNECT_TIMEOUT),
+        # Retries are AsyncPanelTransport's (they cover 502/503/504 too)
+        limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+    )
+    runtime.clients = [AsyncPanelClient(api, runtime.http) for api in core.scrapers]
+    runtime.poller = asyncio.create_task(poll_loop())
+
+
+async def shutdown():
+    core.bot_stats['is_running'] = False
+    if runtime.poller:
+        runtime.poller.cancel()
+    if runtime.http:
+        await runtime.http.aclose()
+    with core.live_events.lock:
+        core.live_events.subscribers.discard(runtime.events)
+
+#============================================
+# ASGI App
+#============================================
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def api_stream(scope, receive, send):
+    q = asyncio.Queue(maxsize=core.SSE_QUEUE_SIZE)
+    runtime.events.subscribers.add(q)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    disconnected.add_done_callback(lambda _: q.put_nowait(None) if not q.full() else None)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while not disconnected.done():
+            try:
+                payload = await asyncio.wait_for(q.get(), core.SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                payload = ': ping\n\n'
+            if payload is None:
+                break
+            await send({'type': 'http.response.body', 'body': payload.encode('utf-8'), 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    except OSError:
+        pass  # client went away mid-write
+    finally:
+        runtime.events.subscribers.discard(q)
+        disconnected.cancel()
+
+
+async def api_otp(scope, receive, send, phone):
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    try:
+        wait = min(max(float(args.get('wait', ['0'])[0]), 0), core.OTP_WAIT_MAX)
+        since = float(args.get('since', ['0'])[0])
+    except ValueError:
+        wait, since = 0, 0
+    msg = await runtime.waiters.wait(phone, since, wait)
+    if msg is None:
+        return await send_response(send, 404, core.dump_json({'status': 'timeout', 'phone': phone}))
+    await send_response(send, 200, core.dump_json({'status': 'ok', 'otp': msg['otp'], 'message': msg}))
+
+
+async def api_refresh(scope, receive, send):
+    add_debug("⚡ Manual refresh triggered")
+
+    async def run(job):
+        try:
+            core.refresh_jobs.finish(job, await check_and_update(force=True))
+        except Exception as e:
+            core.refresh_jobs.finish(job, error=e)
+
+    job = core.refresh_jobs.submit(start=lambda job: asyncio.ensure_future(run(job)))
+    await send_response(send, 202, core.dump_json({
+        'status': 'accepted',
+        'job': job['id'],
+        'url': f"/api/jobs/{job['id']}",
+        'count': len(core.message_store)
+    }))
+
+
+def wsgi_environ(scope, body):
+    headers = {}
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        headers[key] = f"{headers[key]},{value}" if key in headers else value
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_TYPE': headers.pop('CONTENT_TYPE', ''),
+        'CONTENT_LENGTH': headers.pop('CONTENT_LENGTH', str(len(body))),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update((f'HTTP_{key}', value) for key, value in headers.items())
+    return environ
+
+
+def run_wsgi(environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    result = core.app.wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body
+
+
+async def call_wsgi(scope, receive, send):
+    # The Flask views (/, /api/messages, /api/history, /api/debug, /metrics, ...)
+    # are all short; they run on the bridge's thread pool
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    environ = wsgi_environ(scope, b''.join(chunks))
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(runtime.wsgi_executor, run_wsgi, environ)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    if scope['method'] == 'GET':
+        if path == '/api/stream':
+            return await api_stream(scope, receive, send)
+        if path.startswith('/api/otp/') and len(path) > len('/api/otp/'):
+            start = time.perf_counter()
+            await api_otp(scope, receive, send, unquote(path[len('/api/otp/'):]))
+            core.HTTP_SECONDS.observe(time.perf_counter() - start, '/api/otp/<phone>', 'GET')
+            return
+        if path == '/api/refresh':
+            start = time.perf_counter()
+            await api_refresh(scope, receive, send)
+            core.HTTP_SECONDS.observe(time.perf_counter() - start, '/api/refresh', 'GET')
+            return
+    await call_wsgi(scope, receive, send)
+
+
+core.metrics.gauge('otp_async_streams', 'Open /api/stream connections on the asyncio runtime.',
+                   lambda: len(runtime.events.subscribers) if runtime.events else 0)
+core.metrics.gauge('otp_async_waiters', 'Requests waiting in /api/otp/<phone> on the asyncio runtime.',
+                   lambda: len(runtime.waiters) if runtime.waiters else 0)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), log_level='warning')
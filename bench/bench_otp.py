@@ -0,0 +1,74 @@
+"""Micro-benchmark for the OTP extraction engine.
+
+Runs app.extract_otp (and the pre-engine implementation, for comparison) over the
+labelled corpus in otp_corpus.json and prints throughput and accuracy as JSON.
+
+    python bench/bench_otp.py [--rounds 2000]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import extract_otp  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'otp_corpus.json')
+
+
+def legacy_extract_otp(content):
+    if not content:
+        return 'N/A'
+    patterns = [
+        r'(\d{3}[-\s]?\d{3})',
+        r'(\d{4}[-\s]?\d{4})',
+        r'(?:code|kode|otp)[:\s]*(\d{4,8})',
+        r'(\d{6})',
+        r'(\d{4,8})',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, content, re.I)
+        if match:
+            return match.group(1).replace(' ', '-')
+    return 'N/A'
+
+
+def run(extract, corpus, rounds):
+    texts = [case['text'] for case in corpus]
+    misses = [case for case in corpus if extract(case['text']) != case['otp']]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            extract(text)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'messages_per_sec': round(rounds * len(texts) / elapsed),
+        'accuracy': round(1 - len(misses) / len(corpus), 4),
+        'misses': [case['text'] for case in misses],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    results = {
+        'corpus_size': len(corpus),
+        'rounds': args.rounds,
+        'engine': run(extract_otp, corpus, args.rounds),
+        'legacy': run(legacy_extract_otp, corpus, args.rounds),
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
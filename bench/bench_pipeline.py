@@ -0,0 +1,210 @@
+"""End-to-end benchmark of the dashboard against the local fake panel.
+
+Starts bench/fake_panel.py in a subprocess, points the app at it and prints, as
+JSON:
+
+  parse            messages/s through JSON decoding + normalization, in memory
+  fetch            messages/s through PanelAPI.fetch_messages over HTTP
+  poll_to_visible  ms from a message landing on the panel to /api/messages
+                   serving it (check_and_update + the route)
+  routes           p50/p99 ms for / and /api/messages under concurrent clients,
+                   with polls landing new messages in the background
+
+    python bench/bench_pipeline.py [--page-size 200] [--variants 4] [--clients 8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from fake_panel import FakePanel  # noqa: E402
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples_ms):
+    return {
+        'count': len(samples_ms),
+        'p50_ms': round(percentile(samples_ms, 50), 3) if samples_ms else None,
+        'p99_ms': round(percentile(samples_ms, 99), 3) if samples_ms else None,
+        'max_ms': round(max(samples_ms), 3) if samples_ms else None,
+    }
+
+
+def start_panel(args):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, 'fake_panel.py'), '--port', '0',
+        '--page-size', str(args.page_size), '--new-per-poll', '0',
+        '--variants', str(args.variants), '--wrapper', args.wrapper,
+        '--token-ttl', str(args.token_ttl), '--latency', str(args.latency),
+        '--error-rate', str(args.error_rate),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().split()[-1]
+    return process, url
+
+
+def bench_parse(app, args):
+    panel = FakePanel(args.page_size, 0, args.variants, args.wrapper)
+    panel.inject(args.page_size)
+    body = json.dumps(panel.page()).encode('utf-8')
+    normalizer = app.MessageNormalizer()
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        data = app.json_loads(body)
+        rows = data if isinstance(data, list) else data[args.wrapper]
+        normalizer.normalize(rows, 'bench')
+    elapsed = time.perf_counter() - start
+    return {
+        'json_backend': app.JSON_BACKEND,
+        'page_bytes': len(body),
+        'messages_per_sec': round(args.rounds * args.page_size / elapsed),
+    }
+
+
+def bench_fetch(app, url, args):
+    api = app.PanelAPI(url, 'bench', 'bench', name='bench')
+    api.login()
+    fetched = 0
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        # Forget the previous page so every row goes through the whole pipeline
+        api.seen_ids = {}
+        fetched += len(api.fetch_messages())
+    elapsed = time.perf_counter() - start
+    return {
+        'polls': args.rounds,
+        'messages': fetched,
+        'messages_per_sec': round(fetched / elapsed),
+        'polls_per_sec': round(args.rounds / elapsed, 1),
+        'transport': api.transport.stats(),
+    }
+
+
+def bench_poll_to_visible(app, url, args):
+    client = app.app.test_client()
+    samples = []
+    for _ in range(args.visible_rounds):
+        version = app.message_store.version
+        start = time.perf_counter()
+        content = requests.post(f'{url}/bench/inject', params={'count': 1}).json()['contents'][0]
+        app.check_and_update(force=True)
+        payload = client.get('/api/messages', query_string={'since': version}).get_json()
+        if any(msg['raw_message'] == content[:200] for msg in payload['messages']):
+            samples.append((time.perf_counter() - start) * 1000)
+    return {**summarize(samples), 'missed': args.visible_rounds - len(samples)}
+
+
+def bench_routes(app, url, args):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        disable_nagle_algorithm = True
+
+        def log_request(self, *args):
+            pass
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    stop = threading.Event()
+    timings = {'/': [], '/api/messages': []}
+    lock = threading.Lock()
+
+    def poller():
+        while not stop.wait(args.poll_every):
+            requests.post(f'{url}/bench/inject', params={'count': args.new_per_poll})
+            app.check_and_update(force=True)
+
+    def client():
+        session = requests.Session()
+        local = {path: [] for path in timings}
+        while not stop.is_set():
+            for path in local:
+                start = time.perf_counter()
+                session.get(base + path).content
+                local[path].append((time.perf_counter() - start) * 1000)
+        with lock:
+            for path, samples in local.items():
+                timings[path].extend(samples)
+
+    threads = [threading.Thread(target=poller)]
+    threads += [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    return {
+        'clients': args.clients,
+        'duration_s': args.duration,
+        **{path: {**summarize(samples), 'rps': round(len(samples) / args.duration, 1)}
+           for path, samples in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--variants', type=int, default=4, help='key spellings mixed in a page (1-4)')
+    parser.add_argument('--wrapper', default='sms', help="'list' for a bare array, else the wrapping key")
+    parser.add_argument('--token-ttl', type=int, default=0, help='panel fetches per token before a 401')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the panel adds to each fetch')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of panel fetches failing with 503')
+    parser.add_argument('--rounds', type=int, default=200, help='pages for the parse and fetch runs')
+    parser.add_argument('--visible-rounds', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of route load')
+    parser.add_argument('--poll-every', type=float, default=0.5, help='seconds between polls during route load')
+    parser.add_argument('--new-per-poll', type=int, default=3)
+    args = parser.parse_args()
+
+    process, url = start_panel(args)
+    try:
+        # Hermetic app config: only the fake panel, memory-only, single process
+        os.environ.update({
+            'PANEL_URL': url, 'PANELS_FILE': '', 'HISTORY_DB': '', 'SHARED_STATE_DIR': '',
+            'PANEL_RETRY_BACKOFF': '0', 'LOG_LEVEL': 'WARNING',
+        })
+        os.environ.pop('PANELS', None)
+        import app
+        app.scrapers = app.create_scrapers()
+
+        results = {
+            'config': vars(args),
+            'parse': bench_parse(app, args),
+            'fetch': bench_fetch(app, url, args),
+            'poll_to_visible': bench_poll_to_visible(app, url, args),
+            'routes': bench_routes(app, url, args),
+            'panel': requests.get(f'{url}/bench/stats').json(),
+            'app': {
+                'relogins': sum(app.RELOGINS.values.values()),
+                'errors': {':'.join(key): value for key, value in app.ERRORS.values.items()},
+            },
+        }
+    finally:
+        process.terminate()
+        process.wait()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Local stand-in for the SMS panel API, for benchmarks and offline runs.
+
+Implements POST /api/auth/login and GET /api/sms with synthetic messages.
+Page size, key spellings, response wrapper, token expiry (401s), added latency
+and injected 5xx errors are all configurable. Benchmarks drive it through
+POST /bench/inject?count=N (returns the new message texts) and GET /bench/stats.
+
+    python bench/fake_panel.py --port 8081 --new-per-poll 3
+    PANEL_URL=http://127.0.0.1:8081 python app.py
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Key spellings seen across panel builds; a page cycles through the first
+# `variants` of them.
+SPELLINGS = [
+    {'id': 'id', 'content': 'content', 'phone': 'Number', 'country': 'country', 'service': 'service', 'time': 'created_at'},
+    {'id': '_id', 'content': 'message', 'phone': 'number', 'country': 'Country', 'service': 'sender', 'time': 'timestamp'},
+    {'id': 'id', 'content': 'text', 'phone': 'phone', 'country': 'country', 'service': 'Service', 'time': 'created_at'},
+    {'id': None, 'content': 'content', 'phone': 'number', 'country': 'Country', 'service': None, 'time': 'created_at'},
+]
+
+TEMPLATES = [
+    ('WhatsApp', 'Your WhatsApp code is {otp}. Do not share it.'),
+    ('Google', 'G-{otp} is your Google verification code.'),
+    ('Telegram', 'Telegram code: {otp}'),
+    ('Facebook', '{otp} is your Facebook confirmation code'),
+    ('Instagram', 'Use {otp} to verify your Instagram account.'),
+    ('TikTok', '[TikTok] {otp} is your verification code, valid for 5 minutes.'),
+]
+
+COUNTRIES = ['Egypt', 'Saudi Arabia', 'USA', 'Indonesia', 'Brazil', 'India']
+
+
+class FakePanel:
+    def __init__(self, page_size=50, new_per_poll=5, variants=1, wrapper='sms',
+                 token_ttl=0, latency=0.0, error_rate=0.0, seed=1):
+        self.page_size = page_size
+        self.new_per_poll = new_per_poll
+        self.variants = max(1, min(variants, len(SPELLINGS)))
+        self.wrapper = wrapper
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = []  # newest first
+        self.next_id = itertools.count(1)
+        self.token = None
+        self.token_uses = 0
+        self.counts = {'logins': 0, 'fetches': 0, 'unauthorized': 0, 'errors': 0}
+        self.server = None
+
+    def inject(self, count):
+        # Adds `count` messages at the top of the feed and returns their contents
+        stamp = datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+        with self.lock:
+            added, contents = [], []
+            for _ in range(count):
+                n = next(self.next_id)
+                spelling = SPELLINGS[n % self.variants]
+                service, template = TEMPLATES[n % len(TEMPLATES)]
+                msg = {
+                    spelling['content']: template.format(otp=f'{self.random.randrange(10**6):06d}'),
+                    spelling['phone']: f'+{self.random.randrange(10**10, 10**11)}',
+                    spelling['country']: COUNTRIES[n % len(COUNTRIES)],
+                    spelling['time']: stamp,
+                }
+                if spelling['id']:
+                    msg[spelling['id']] = n
+                if spelling['service']:
+                    msg[spelling['service']] = service
+                added.append(msg)
+                contents.append(msg[spelling['content']])
+            self.messages[:0] = added[::-1]
+            del self.messages[max(self.page_size, 1000):]
+            return contents
+
+    def page(self):
+        with self.lock:
+            rows = self.messages[:self.page_size]
+        if self.wrapper == 'list':
+            return rows
+        return {'total': len(rows), self.wrapper: rows}
+
+    def login(self):
+        with self.lock:
+            self.counts['logins'] += 1
+            self.token = f'tok-{self.counts["logins"]}'
+            self.token_uses = 0
+            return self.token
+
+    def authorize(self, header):
+        # A token is good for `token_ttl` fetches (0 = forever)
+        with self.lock:
+            if self.token is None or header != f'Bearer {self.token}':
+                self.counts['unauthorized'] += 1
+                return False
+            self.token_uses += 1
+            if self.token_ttl and self.token_uses > self.token_ttl:
+                self.token = None
+                self.counts['unauthorized'] += 1
+                return False
+            return True
+
+    def start(self, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self.server.server_port}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def _handler(panel):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this, Nagle plus
+        # delayed ACKs add ~40ms to every response
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path, _, query = self.path.partition('?')
+            if path == '/api/auth/login':
+                return self._send(200, {'token': panel.login()})
+            if path == '/bench/inject':
+                count = int(parse_qs(query).get('count', ['1'])[0])
+                return self._send(200, {'contents': panel.inject(count)})
+            self._send(404, {'error': 'not found'})
+
+        def do_GET(self):
+            if self.path == '/bench/stats':
+                with panel.lock:
+                    counts = dict(panel.counts)
+                return self._send(200, counts)
+            if not self.path.startswith('/api/sms'):
+                return self._send(404, {'error': 'not found'})
+            if panel.latency:
+                time.sleep(panel.latency)
+            if panel.error_rate and panel.random.random() < panel.error_rate:
+                with panel.lock:
+                    panel.counts['errors'] += 1
+                return self._send(503, {'error': 'injected'})
+            if not panel.authorize(self.headers.get('Authorization')):
+                return self._send(401, {'error': 'token expired'})
+            with panel.lock:
+                panel.counts['fetches'] += 1
+            if panel.new_per_poll:
+                panel.inject(panel.new_per_poll)
+            self._send(200, panel.page())
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--new-per-poll', type=int, default=5)
+    parser.add_argument('--variants', type=int, default=1, help=f'key spellings to mix (1-{len(SPELLINGS)})')
+    parser.add_argument('--wrapper', default='sms', help="'list' for a bare array, else the wrapping key")
+    parser.add_argument('--token-ttl', type=int, default=0, help='fetches per token before a 401 (0 = never)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fetch')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fetches answered with 503')
+    args = parser.parse_args()
+
+    panel = FakePanel(args.page_size, args.new_per_poll, args.variants, args.wrapper,
+                      args.token_ttl, args.latency, args.error_rate)
+    panel.inject(args.page_size)
+    print(f'Fake panel on {panel.start(args.host, args.port)}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        panel.stop()
+
+
+if __name__ == '__main__':
+    main()
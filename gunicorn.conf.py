@@ -0,0 +1,15 @@
+import os
+
+# Workers share one poller and one view of the messages through this directory
+# (see SharedState in app.py).
+os.environ.setdefault('SHARED_STATE_DIR', '/tmp/otp-dashboard')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+
+def post_worker_init(worker):
+    # gunicorn never calls app.main(); every worker joins the poller election
+    from app import start_background_monitor
+    start_background_monitor()